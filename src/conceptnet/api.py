@@ -1,40 +1,215 @@
 # -*- coding: utf-8 -*-
 
+import os
 import time
 import logging
 import requests
-from os.path import join
-from utils.utils import save_json
+import threading
+from os.path import join, exists, normpath
+from requests.adapters import HTTPAdapter
+from multiprocessing.pool import ThreadPool
+from utils.utils import save_json, load_json
 
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s %(levelname)s %(message)s')
+BASE_URL = 'http://api.conceptnet.io'
+RATE = 1.0 # requests per second allowed by the API (3600 per hour)
+BURST = 120 # requests that can be made at once (120 per minute)
 
-def collect_relations(objects, relations, conceptnet_path, delay=3):
-    ''' Collect relations for a list of objects '''
-    for obj in objects:
-        for relation in relations:
-            logging.debug('Extracting relation: %s %s' % (obj, relation))
-            get_relations(obj, relation, conceptnet_path)
-            time.sleep(delay)
-
-def get_relations(object_name, relation, conceptnet_path, limit=100):
-    ''' Get relations of an object throught Conceptnet RESTful API '''
-    base_query = 'http://api.conceptnet.io/query?node=/c/en/%s&rel=/r/%s&offset=%d&limit=%d'
-    data = {}
-    flag = True
+class Token_Bucket:
+    '''
+    Class that implements a thread-safe token bucket, which allows rate requests per second on average and bursts of
+    up to capacity requests
+    '''
+
+    def __init__(self, rate=RATE, capacity=BURST):
+        self.__rate = float(rate)
+        self.__capacity = float(capacity)
+        self.__tokens = float(capacity)
+        self.__updated = time.time()
+        self.__lock = threading.Lock()
+
+    def acquire(self):
+        ''' Wait until a token is available and take it '''
+        while True:
+            with self.__lock:
+                now = time.time()
+                self.__tokens = min(self.__capacity, self.__tokens + (now - self.__updated) * self.__rate)
+                self.__updated = now
+                if self.__tokens >= 1:
+                    self.__tokens -= 1
+                    return
+                wait = (1 - self.__tokens) / self.__rate
+            time.sleep(wait)
+
+class ConceptNet_Client:
+    '''
+    Class that implements a client of the Conceptnet RESTful API shared by several threads, with a pool of
+    connections, a token bucket to stay within the quota of the API and exponential backoff when it answers 429 or 5xx
+    '''
+
+    def __init__(self, base_url=BASE_URL, rate=RATE, burst=BURST, connections=4, retries=5, backoff=2.0, timeout=60):
+        self.__base_url = base_url.rstrip('/')
+        self.__bucket = Token_Bucket(rate, burst)
+        self.__retries = retries
+        self.__backoff = backoff
+        self.__timeout = timeout
+        self.__session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=connections)
+        self.__session.mount('http://', adapter)
+        self.__session.mount('https://', adapter)
+
+    def get_json(self, query):
+        ''' Get the JSON answer of a query, e.g. '/query?node=/c/en/bed', or None if it fails after all the retries '''
+        url = self.__base_url + query
+        for attempt in xrange(self.__retries + 1):
+            self.__bucket.acquire()
+            delay = self.__backoff * 2 ** attempt
+            try:
+                response = self.__session.get(url, timeout=self.__timeout)
+                if response.status_code == 429 or response.status_code >= 500:
+                    delay = max(delay, get_retry_after(response))
+                    error = 'HTTP %d' % response.status_code
+                else:
+                    response.raise_for_status()
+                    return response.json()
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = str(e)
+            except (requests.HTTPError, ValueError) as e: # client errors and corrupted JSON are not retried
+                logging.error('Error "%s" in "%s"' % (e, url))
+                return None
+            if attempt < self.__retries:
+                logging.warning('Error "%s" in "%s", retrying in %.0fs' % (error, url, delay))
+                time.sleep(delay)
+
+        logging.error('Error "%s" in "%s" after %d retries' % (error, url, self.__retries))
+        return None
+
+class Crawl_Manifest:
+    '''
+    Class that implements the manifest of a crawl, a JSON file with the status of each (object, relation) pair and
+    the nextPage of each of its downloaded pages, so that an interrupted crawl continues where it stopped. Without a
+    path it is only kept in memory
+    '''
+
+    def __init__(self, manifest_path=None):
+        self.__manifest_path = manifest_path
+        self.__lock = threading.Lock()
+        self.__units = load_json(manifest_path) if manifest_path and exists(manifest_path) else {}
+
+    def get_status(self, object_name, relation):
+        ''' Get the status of a pair: 'complete', 'partial', 'failed' or None if it was never crawled '''
+        with self.__lock:
+            unit = self.__units.get(get_unit_key(object_name, relation))
+            return unit['status'] if unit else None
+
+    def get_page(self, object_name, relation, offset):
+        ''' Get (True, nextPage) for a downloaded page, where nextPage is None in the last one, or (False, None) '''
+        with self.__lock:
+            pages = self.__units.get(get_unit_key(object_name, relation), {}).get('pages', {})
+            return (True, pages[str(offset)]) if str(offset) in pages else (False, None)
+
+    def set_page(self, object_name, relation, offset, next_page):
+        ''' Record a downloaded page and the pointer to the next one '''
+        with self.__lock:
+            unit = self.get_unit(object_name, relation)
+            unit['pages'][str(offset)] = next_page
+            unit['status'] = 'partial'
+            self.save()
+
+    def set_status(self, object_name, relation, status, offset=None):
+        ''' Record that a pair is complete, or failed in a page '''
+        with self.__lock:
+            unit = self.get_unit(object_name, relation)
+            unit['status'] = status
+            unit['failed_offset'] = offset
+            self.save()
+
+    def get_unit(self, object_name, relation):
+        ''' Get the record of a pair, creating it if it is new '''
+        key = get_unit_key(object_name, relation)
+        if key not in self.__units:
+            self.__units[key] = {'object':object_name, 'relation':relation, 'status':None, 'pages':{}, 'failed_offset':None}
+
+        return self.__units[key]
+
+    def save(self):
+        ''' Write the manifest to a temporary file that replaces the previous one, so it is never left incomplete '''
+        if self.__manifest_path:
+            temporal_path = '%s.tmp' % self.__manifest_path
+            save_json(self.__units, temporal_path)
+            os.rename(temporal_path, self.__manifest_path)
+
+def collect_relations(objects, relations, conceptnet_path, threads=4, base_url=BASE_URL, rate=RATE, manifest_path=None):
+    ''' Collect relations for a list of objects, crawling several (object, relation) pairs at once within the rate
+    limit of the API. The crawl is recorded in a manifest next to the folder (e.g. raw_manifest.json), so only the
+    pairs that are new or were not finished are crawled '''
+    manifest = Crawl_Manifest(manifest_path or normpath(conceptnet_path) + '_manifest.json')
+    client = ConceptNet_Client(base_url, rate, connections=threads)
+    tasks = [(obj, relation, conceptnet_path, client, manifest) for obj in objects for relation in relations
+             if manifest.get_status(obj, relation) != 'complete']
+    logging.info('Crawling %d of %d (object, relation) pairs' % (len(tasks), len(objects) * len(relations)))
+    pool = ThreadPool(threads)
+    try:
+        for done, (obj, relation) in enumerate(pool.imap_unordered(collect_relation, tasks), 1):
+            logging.debug('Extracted relation: %s %s (%d/%d)' % (obj, relation, done, len(tasks)))
+    finally:
+        pool.close()
+        pool.join()
+
+def collect_relation(task):
+    ''' Get the relations of an (object, relation) pair in a thread '''
+    obj, relation, conceptnet_path, client, manifest = task
+    get_relations(obj, relation, conceptnet_path, client=client, manifest=manifest)
+
+    return obj, relation
+
+def get_relations(object_name, relation, conceptnet_path, limit=100, client=None, manifest=None):
+    ''' Get relations of an object throught Conceptnet RESTful API, following its pages until the last one or a
+    page that can not be downloaded. The pages in the manifest, or already saved, are not downloaded again '''
+    client = client or ConceptNet_Client()
+    manifest = manifest or Crawl_Manifest()
+    base_query = '/query?node=/c/en/%s&rel=/r/%s&offset=%d&limit=%d'
     index = 0
 
-    while flag:
+    while True:
+        downloaded, next_page = manifest.get_page(object_name, relation, index)
+        if not downloaded:
+            page_path = join(conceptnet_path, '%s_%s_%d.json' % (object_name, relation, index))
+            data = load_page(page_path)
+            if data is None:
+                data = client.get_json(base_query % (object_name, relation, index, limit))
+                if data is None:
+                    manifest.set_status(object_name, relation, 'failed', index)
+                    return
+                save_json(data, page_path)
+            next_page = data.get('view', {}).get('nextPage')
+            manifest.set_page(object_name, relation, index, next_page)
+
+        if next_page is None:
+            manifest.set_status(object_name, relation, 'complete')
+            return
+        index += limit
+
+def load_page(page_path):
+    ''' Load a page saved by a previous crawl, or None if it does not exist or is corrupted '''
+    if exists(page_path):
         try:
-            data = requests.get(base_query % (object_name, relation, index, limit)).json()
-            save_json(data, join(conceptnet_path, '%s_%s_%d.json' % (object_name, relation, index)))
-        except:
-            query = base_query % (object_name, relation, index, limit)
-            logging.error('Corrupted JSON file in "%s"' % query)
- 
-        if 'view' in data and 'nextPage'in data['view']:
-            index += limit
-        else:
-            flag = False
+            return load_json(page_path)
+        except ValueError:
+            logging.warning('Corrupted JSON file "%s", downloading it again' % page_path)
+
+    return None
+
+def get_unit_key(object_name, relation):
+    ''' Get the key of an (object, relation) pair in the manifest '''
+    return '%s %s' % (object_name, relation)
+
+def get_retry_after(response):
+    ''' Get the seconds to wait from the Retry-After header of an answer, 0 if it does not have it '''
+    try:
+        return float(response.headers.get('Retry-After', 0))
+    except ValueError:
+        return 0
 
 def get_uri(object_id, delay=3):
     ''' Get the URI of an object throught Conceptnet RESTful API '''
@@ -56,4 +231,4 @@ def get_uri(object_id, delay=3):
     #if len(data['edges']) > 0:# TODO: Include other resources?
     #    return data['edges'][0]['end']['@id']
 
-    return None
\ No newline at end of file
+    return None
@@ -16,7 +16,7 @@ def create_dataset(conceptnet_raw_path, house_objects_path, relations_path):
     objects = load_json(house_objects_path).keys()
     objects = [x.replace(' ', '_') for x in objects]
     relations = [line.rstrip() for line in open(relations_path)]
-    collect_relations(objects, relations, conceptnet_raw_path, 7)
+    collect_relations(objects, relations, conceptnet_raw_path)
 
 def select_relations(conceptnet_raw_path, concepnet_parsed_path, house_objects_path):#
     ''' Select some relations from Conceptnet JSON files '''
@@ -3,18 +3,23 @@
 import os
 import re
 import logging
+import numpy as np
 import xml.etree.ElementTree as ET
 import utils.image_downloader as downloader
 from os.path import join, dirname
 from prettytable import PrettyTable
-from collections import Counter
-from gensim.models.keyedvectors import KeyedVectors
-from utils.utils import load_json, save_json, load_file, save_file, map_wn31wn30, map_wn30lemma, map_wn31db, create_uri, map_netlemma
+from collections import Counter, OrderedDict
+from utils.utils import load_json, save_json, load_file, save_file, map_wn31wn30, map_wn30lemma, map_wn31db, create_uri, map_netlemma, load_compiled_folder
 from verbalize import verbalize_frame
-from ntriples_reader import read_folder_frames
-from prototypical_frame import find_prototypical_instances
+from itertools import islice
+from ntriples_reader import read_folder_frames, iter_folder_records, iter_folder_elements, get_element_names
+from prototypical_frame import find_prototypical_instances, streaming_frequency_approach
+from scheduler import map_frame_types
+from workerpool import set_processes, share, shared
 
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s %(levelname)s %(message)s')
+READ_SIZE = 2 ** 24 # bytes read at once from a word2vec file
+BATCH_SIZE = 100000 # frame instances verified at once when they are read as a stream
 
 class Validator_By_Core:
     '''
@@ -22,7 +27,9 @@ class Validator_By_Core:
     '''
 
     def __init__(self, annotations_path, threshold=0.75):
-        self.__annotations = self.get_frametype_annotations(annotations_path)
+        annotations = load_compiled_folder(os.path.normpath(annotations_path) + '.pkl', annotations_path,
+                                           lambda: self.get_frametype_annotations(annotations_path))
+        self.__annotations = {x:(set(y), len(y)) for x, y in annotations.items()} # frame type -> (core elements, total)
         self.__threshold = threshold
 
     def get_frametype_annotations(self, frame_types_path):
@@ -42,8 +49,8 @@ class Validator_By_Core:
 
     def is_valid(self, frame_type, frame_elements):
         ''' Verify if a frame instance has the majority of core frame elements '''
-        frame_element_cores = self.__annotations[frame_type]
-        total = float(len(frame_element_cores))
+        frame_element_cores, total = self.__annotations[frame_type]
+        total = float(total)
         cont = sum([1 for x in frame_elements.keys() if x in frame_element_cores])
 
         if total == 0:#just 5 cases without core elements
@@ -53,6 +60,14 @@ class Validator_By_Core:
         else:
             return False
 
+    def prepare(self, frame_elements_list):
+        ''' Nothing to prepare, the annotations are loaded at once '''
+        pass
+
+    def is_valid_batch(self, frame_type, frame_elements_list):
+        ''' Verify a list of frame instances of the same frame type '''
+        return [self.is_valid(frame_type, x) for x in frame_elements_list]
+
 
 class Validator_By_Synset:
     '''
@@ -60,9 +75,20 @@ class Validator_By_Synset:
     '''
 
     def __init__(self, annotations_path):
-        self.__annotations = self.get_frameelement_annotations(annotations_path)
+        self.__annotations = load_compiled_folder(os.path.normpath(annotations_path) + '.pkl', annotations_path,
+                                                  lambda: self.compile_annotations(self.get_frameelement_annotations(annotations_path)))
         self.__wn31wn30 = map_wn31wn30()
 
+    def compile_annotations(self, fe_annotations):
+        ''' Convert the annotations of frame elements to sets of their synset ids '''
+        frame_element_synsets = {}
+        for frame_type in fe_annotations:
+            frame_element_synsets[frame_type] = {}
+            for fe in fe_annotations[frame_type]:
+                frame_element_synsets[frame_type][fe] = {x['synset_id'] for x in fe_annotations[frame_type][fe]}
+
+        return frame_element_synsets
+
     def get_frameelement_annotations(self, frame_elements_path):
         ''' Load the annotations of frame elements '''
         fe_annotations = {}
@@ -85,11 +111,7 @@ class Validator_By_Synset:
     def is_valid(self, frame_type, frame_elements):
         ''' Verify if a frame instance has at least one annotated synset in its frame elements '''
         frame_elements = {x:self.__wn31wn30[frame_elements[x]][:-2] for x in frame_elements}
-        frame_element_synsets = {}
-
-        if frame_type in self.__annotations:
-            for fe in self.__annotations[frame_type]:
-                frame_element_synsets[fe] = {x['synset_id'] for x in self.__annotations[frame_type][fe]} 
+        frame_element_synsets = self.__annotations.get(frame_type, {})
 
         cont = 0
         for fe in frame_elements:
@@ -101,39 +123,78 @@ class Validator_By_Synset:
         else:
             return False
 
+    def prepare(self, frame_elements_list):
+        ''' Nothing to prepare, the annotations are loaded at once '''
+        pass
+
+    def is_valid_batch(self, frame_type, frame_elements_list):
+        ''' Verify a list of frame instances of the same frame type '''
+        return [self.is_valid(frame_type, x) for x in frame_elements_list]
+
 class Validator_By_Embeddings:
     '''
-    Class that implements a frame validator according to the similarity between frame elements and its values (words)
+    Class that implements a frame validator according to the similarity between frame elements and its values (words).
+    Only the vectors of the words in the frame instances are read from the embeddings, in a normalized matrix.
     '''
 
     def __init__(self, model_path):
-        self.__model = KeyedVectors.load_word2vec_format(model_path, binary=True)
+        self.__model_path = model_path
         self.__wn31wn30 = map_wn31wn30()
         self.__wn30lemma = map_wn30lemma()
-
-    def is_valid(self, frame_type, frame_elements):
-        ''' Verify if a frame instance has strong similarity in its frame elements '''
-        frame_elements = {x:self.__wn30lemma[self.__wn31wn30[frame_elements[x]]] for x in frame_elements}
-        total = float(len(frame_elements))
-        similarity = 0
-
+        self.__index = {} # word -> row of the vectors
+        self.__vectors = np.zeros((0, 0), dtype=np.float32)
+        self.__searched = set() # words already searched in the embeddings
+
+    def prepare(self, frame_elements_list):
+        ''' Read the vectors of all the words of some frame instances, so that they are read only once '''
+        self.load_words(set(word for x in frame_elements_list for word in self.get_words(x)))
+
+    def load_words(self, words):
+        ''' Read the vectors of the words that were not searched yet '''
+        words = set(words) - self.__searched
+        if words:
+            index, vectors = read_word2vec_vectors(self.__model_path, words)
+            offset = len(self.__index)
+            self.__index.update({x:offset + i for x, i in index.items()})
+            self.__vectors = np.vstack([self.__vectors, vectors]) if offset > 0 else vectors
+            self.__searched.update(words)
+
+    def get_words(self, frame_elements):
+        ''' Get the (role, filler) words of a frame instance, in UTF-8 as in the embeddings '''
+        words = []
         for role, filler in frame_elements.items():
-            if role in self.__model.vocab and filler in self.__model.vocab:
-                similarity += self.__model.similarity(role, filler)
-            else:
-                total -= 1
-
-        if total == 0: # all roles and fillers are not present in the embeddings
-            return True
-
-        if similarity / total > 0.7:
-            return True
-
-        return False
+            filler = self.__wn30lemma[self.__wn31wn30[filler]]
+            words.append((encode_word(role), encode_word(filler)))
 
+        return words
 
-def create_dataset(option, frame_raw_path, frame_parsed_path):
-    ''' Create a dataset of frame triples according to a Validator (by core, by synset or by embeddings) '''
+    def is_valid(self, frame_type, frame_elements):
+        ''' Verify if a frame instance has strong similarity in its frame elements '''
+        return self.is_valid_batch(frame_type, [frame_elements])[0]
+
+    def is_valid_batch(self, frame_type, frame_elements_list):
+        ''' Verify a list of frame instances of the same frame type, computing the cosine similarities of all their
+        (role, filler) pairs at once '''
+        instance_words = [self.get_words(x) for x in frame_elements_list]
+        self.load_words(set(word for x in instance_words for pair in x for word in pair))
+        pairs = [(i, self.__index[role], self.__index[filler]) for i, words in enumerate(instance_words)
+                 for role, filler in words if role in self.__index and filler in self.__index]
+        size = len(frame_elements_list)
+        if not pairs:
+            return [True] * size # all roles and fillers are not present in the embeddings
+
+        instances, roles, fillers = np.array(pairs, dtype=np.int64).T
+        similarities = np.einsum('ij,ij->i', self.__vectors[roles], self.__vectors[fillers])
+        total = np.bincount(instances, minlength=size)
+        similarity = np.bincount(instances, similarities, minlength=size)
+        valid = (total == 0) | (similarity / np.maximum(total, 1) > 0.7)
+
+        return valid.tolist()
+
+def create_dataset(option, frame_raw_path, frame_parsed_path, processes=4, streaming=False):
+    ''' Create a dataset of frame triples according to a Validator (by core, by synset or by embeddings). With
+    streaming=True the prototypical frames are the most frequent instances, found while the files are read '''
+    set_processes(processes)
     obj_validator = None
     if option == 'core':
         frame_types_path = join(dirname(__file__), '../../resource/frames/annotations_frame_types/')
@@ -148,28 +209,106 @@ def create_dataset(option, frame_raw_path, frame_parsed_path):
         logging.error('Unknown "%s" option of frame validator' % option)
 
     if obj_validator:
-        frame_instances = read_folder_frames(frame_raw_path, delete_repetition=False)
-        filtered_frames = filter_instances(frame_instances, obj_validator)
-        prototypical_frames = find_prototypical_instances(filtered_frames)
+        if streaming:
+            records = iter_valid_records(frame_raw_path, obj_validator)
+            prototypical_frames = streaming_frequency_approach(records)
+        else:
+            frame_instances = read_folder_frames(frame_raw_path, delete_repetition=False)
+            filtered_frames = filter_instances(frame_instances, obj_validator)
+            prototypical_frames = find_prototypical_instances(filtered_frames)
 
         save_json(prototypical_frames, join(frame_parsed_path, 'frame_instances.json'))
         logging.info('Selected %s prototypical frames' % len(prototypical_frames))
 
 def filter_instances(frame_instances, obj_validator):
-    ''' Filter out frame instances according to a Validator '''
-    filtered_frames = {}
-   
-    for frame_id in frame_instances.keys():
-        frame = frame_instances[frame_id]
+    ''' Filter out frame instances according to a Validator, verifying all the instances of each frame type at once,
+    and the frame types in parallel in the worker pool '''
+    type_instances = {}
+    for frame_id, frame in frame_instances.items():
         frame_type = frame.frame_type
-        frame_elements = {x.role.lower():x.entity.split('/')[-1][:-1] for x in frame.frame_elements}
-        if obj_validator.is_valid(frame_type.lower(), frame_elements):
-            if frame_type not in filtered_frames:
-                filtered_frames[frame_type] = {}
-            filtered_frames[frame_type][frame_id] = frame
+        if frame_type not in type_instances:
+            type_instances[frame_type] = []
+        type_instances[frame_type].append((frame_id, dict(frame.element_names(lowercase=True))))
+    obj_validator.prepare([y for x in type_instances.values() for _, y in x])
+    share(validator=obj_validator)
+    type_sizes = {x:len(y) for x, y in type_instances.items()}
+    filtered_frames = {}
+
+    for frame_type, valid_ids in map_frame_types(validate_instances, type_instances, type_sizes):
+        if valid_ids:
+            filtered_frames[frame_type] = {x:frame_instances[x] for x in valid_ids}
 
     return filtered_frames
 
+def iter_valid_records(frame_raw_path, obj_validator, batch_size=BATCH_SIZE):
+    ''' Yield the (instance id, frame type, [(role, entity name)]) records of the valid frame instances of a folder
+    or a dump, reading it as a stream and verifying the instances in batches. The validators that prepare resources
+    for the words of the instances (by embeddings) get them in a first pass over the element triples, which reads
+    the raw files once more but does not sort a dump '''
+    obj_validator.prepare(dict(get_element_names([x], lowercase=True)) for x in iter_folder_elements(frame_raw_path))
+    records = ((x, y, get_element_names(z, lowercase=True)) for x, y, z in iter_folder_records(frame_raw_path))
+    total = valid_total = 0
+
+    for batch in iter(lambda: list(islice(records, batch_size)), []):
+        type_rows = {}
+        for row, (_, frame_type, _) in enumerate(batch):
+            if frame_type not in type_rows:
+                type_rows[frame_type] = []
+            type_rows[frame_type].append(row)
+        valid = [False] * len(batch)
+        for frame_type, rows in type_rows.items():
+            for row, is_valid in zip(rows, obj_validator.is_valid_batch(frame_type.lower(), [dict(batch[x][2]) for x in rows])):
+                valid[row] = is_valid
+        for record, is_valid in zip(batch, valid):
+            if is_valid:
+                yield record
+        total += len(batch)
+        valid_total += sum(valid)
+        logging.info('Verified %d frame instances, %d valid' % (total, valid_total))
+
+def validate_instances(frame_type, instances):
+    ''' Get the ids of the valid (id, frame elements) instances of a frame type '''
+    valid = shared['validator'].is_valid_batch(frame_type.lower(), [x[1] for x in instances])
+
+    return [x[0] for x, is_valid in zip(instances, valid) if is_valid]
+
+def read_word2vec_vectors(model_path, words):
+    ''' Read the normalized vectors of some words from a binary word2vec file, skipping the vectors of the other
+    words without decoding them. Return the row of each word found and the matrix of vectors '''
+    index = {}
+    vectors = []
+    with open(model_path, 'rb') as fin:
+        vocabulary_size, dimension = [int(x) for x in fin.readline().split()]
+        vector_size = dimension * np.dtype(np.float32).itemsize
+        buffer = ''
+        position = 0
+        for _ in xrange(vocabulary_size):
+            space = buffer.find(' ', position)
+            while space < 0 or len(buffer) < space + 1 + vector_size: # the word or its vector continue in the next chunk
+                data = fin.read(READ_SIZE)
+                if not data:
+                    raise ValueError('Unexpected end of the word2vec file "%s"' % model_path)
+                buffer = buffer[position:] + data
+                position = 0
+                space = buffer.find(' ')
+            word = buffer[position:space].lstrip('\n')
+            if word in words and word not in index:
+                index[word] = len(vectors)
+                vectors.append(np.frombuffer(buffer, np.float32, dimension, space + 1).copy())
+                if len(index) == len(words):
+                    break
+            position = space + 1 + vector_size
+
+    vectors = np.array(vectors, dtype=np.float32).reshape(len(vectors), dimension)
+    norms = np.linalg.norm(vectors, axis=1)
+    vectors /= np.where(norms > 0, norms, 1)[:, np.newaxis]
+
+    return index, vectors
+
+def encode_word(word):
+    ''' Encode a word in UTF-8, as the words of the word2vec files '''
+    return word.encode('utf-8') if isinstance(word, unicode) else word
+
 def select_relations(frame_parsed_path, house_objects_path):
     ''' Select unique relations of frames about house's object '''
     house_objects = {v.replace(' ', '_'):k['dbpedia_uri'] for v,k in load_json(house_objects_path).items()}
@@ -178,55 +317,48 @@ def select_relations(frame_parsed_path, house_objects_path):
     frame_instances = load_json(join(frame_parsed_path, 'frame_instances.json'))
     netlemma = map_netlemma()
     wn31db = map_wn31db()
-    triple_uris = []
-    triple_labels = []   
+    selected_triples = OrderedDict() # (subject, predicate, object) with URIs -> with labels, in insertion order
 
     for frame_id in frame_instances.keys():
         valid_frame = False
         frame = frame_instances[frame_id]
-        frame_uris, frame_labels = create_triples(frame['type'], frame['elements'], wn31db, netlemma)
-        for i in range(len(frame_uris)):
-            object_uri = re.match('<(.+)> <(.+)> <(.+)>', frame_uris[i]).group(1)
-            if object_uri in house_object_uris and frame_uris[i] not in triple_uris:
-                triple_uris.append(frame_uris[i])
-                triple_labels.append(frame_labels[i])
+        for triple_uri, triple_label in create_triples(frame['type'], frame['elements'], wn31db, netlemma):
+            if triple_uri not in selected_triples and (triple_uri[0] in house_object_uris or triple_label[0] in house_object_names):
+                selected_triples[triple_uri] = triple_label
                 valid_frame = True
-            else:
-                object_name = re.match('<(.+)> <(.+)> <(.+)>', frame_labels[i]).group(1)
-                if object_name in house_object_names and frame_uris[i] not in triple_uris:
-                    triple_uris.append(frame_uris[i])
-                    triple_labels.append(frame_labels[i])
-                    valid_frame = True
         
         if not valid_frame:
             del frame_instances[frame_id]
 
-    calculate_statistics(triple_uris, frame_parsed_path)
-    save_file(join(frame_parsed_path, 'selected_triples.nt'), triple_uris)
-    save_file(join(frame_parsed_path, 'selected_triples_label.nt'), triple_labels)
+    calculate_statistics(selected_triples.keys(), frame_parsed_path)
+    save_file(join(frame_parsed_path, 'selected_triples.nt'), [format_triple(x) for x in selected_triples.keys()])
+    save_file(join(frame_parsed_path, 'selected_triples_label.nt'), [format_triple(x) for x in selected_triples.values()])
     save_file(join(frame_parsed_path, 'selected_verbalized.txt'), [verbalize_frame(f['type'], f['elements'].items(), netlemma) for f in frame_instances.values()])
-    logging.info('Total valid relations with URIs: %s' % len(triple_uris))
+    logging.info('Total valid relations with URIs: %s' % len(selected_triples))
 
 def create_triples(frame_type, frame_elements, wn31db, netlemma):
-    ''' Create RDF triples from frame instance '''
-    triple_uris = []
-    triple_labels = []
+    ''' Create RDF triples from frame instance, as pairs of (subject, predicate, object) tuples with URIs and with labels '''
+    triples = []
     
     for role, filler in frame_elements.items():
         if filler in wn31db: # only frame elements with mappings
-            triple_labels.append('<%s> <%s> <%s>' % (netlemma[filler], role+'Of', frame_type.lower()))
-            triple_uris.append('<%s> <%s> <%s>' % (create_uri(wn31db[filler]), 'http://framebase.org/fe/%s' % role.title() +'Of', 'http://framebase.org/frame/%s' % frame_type))
+            triple_label = (netlemma[filler], role+'Of', frame_type.lower())
+            triple_uri = (create_uri(wn31db[filler]), 'http://framebase.org/fe/%s' % role.title() +'Of', 'http://framebase.org/frame/%s' % frame_type)
+            triples.append((triple_uri, triple_label))
+
+    return triples
 
-    return triple_uris, triple_labels
+def format_triple(triple):
+    ''' Serialize a (subject, predicate, object) tuple as an N-Triples line without the final dot '''
+    return '<%s> <%s> <%s>' % triple
 
 def calculate_statistics(object_relations, output_path):
-    ''' Calculate statistics of the dataset '''
+    ''' Calculate statistics of the dataset, given as (subject, predicate, object) tuples '''
     ftype_counter = set()
     felement_counter = set()
     ffiller_counter = set()
 
-    for triple in object_relations:
-        ffiller, felement, ftype = re.match('<(.+)> <(.+)> <(.+)>', triple).groups()
+    for ffiller, felement, ftype in object_relations:
         ftype_counter.add(ftype)
         felement_counter.add(felement)
         ffiller_counter.add(ffiller)
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*
+
+import os
+import json
+import errno
+import hashlib
+import logging
+import numpy as np
+from os.path import join, exists, getsize
+from distancematrix import create_distance_matrix, open_matrix
+from framecache import get_file_stats
+
+logging.basicConfig(level=logging.DEBUG, format='%(asctime)s %(levelname)s %(message)s')
+DISTANCES_VERSION = 2
+
+def get_matrix_path(distances_path, frame_type, instance_ids, settings, instance_elements=(), resource_paths=()):
+    ''' Get the file of the distance matrix of some frame instances (in this order) computed with some similarity
+    settings, e.g. resource/frames/distances/Arriving_<sha1>.distances. The fingerprint also covers the (role,
+    entity) elements of each instance and the size and mtime of the similarity resources, so that a matrix is not
+    reused when a raw file or a resource changed '''
+    resources = [(os.path.basename(x),) + get_file_stats(x) for x in resource_paths if exists(x)]
+    fingerprint = hashlib.sha1(json.dumps({'version':DISTANCES_VERSION, 'settings':settings, 'instance_ids':instance_ids,
+                                           'resources':resources}, sort_keys=True))
+    for elements in instance_elements:
+        fingerprint.update(json.dumps(elements))
+
+    return join(distances_path, '%s_%s.distances' % (frame_type, fingerprint.hexdigest()))
+
+def load_distance_matrix(matrix_path, size):
+    ''' Map a stored distance matrix, returning None if it does not exist or does not have the expected size '''
+    total_pairs = size * (size - 1) / 2
+    if total_pairs == 0:
+        return np.zeros(0, dtype=np.float64)
+    if not exists(matrix_path) or getsize(matrix_path) != total_pairs * np.dtype(np.float64).itemsize:
+        return None
+
+    return open_matrix(matrix_path, total_pairs, 'r')
+
+def save_distance_matrix(matrix_path, elements, distance_function):
+    ''' Compute and store the distance matrix of some elements, writing it in a temporary file that is renamed at
+    the end, so that an interrupted run never leaves an incomplete matrix '''
+    try:
+        os.makedirs(os.path.dirname(matrix_path))
+    except OSError as e: # several workers can create it at the same time
+        if e.errno != errno.EEXIST:
+            raise
+    temporal_path = '%s.%d.tmp' % (matrix_path, os.getpid())
+
+    try:
+        condensed_matrix = create_distance_matrix(elements, distance_function, matrix_path=temporal_path)
+        if len(condensed_matrix) > 0:
+            os.rename(temporal_path, matrix_path)
+    finally:
+        if exists(temporal_path):
+            os.remove(temporal_path)
+
+    return condensed_matrix
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*
+
+import os
+import cPickle
+import tempfile
+import itertools
+import numpy as np
+from workerpool import get_pool, get_processes
+
+packed_counter = itertools.count()
+worker_elements = {} # key and elements of the last list unpacked in a worker
+
+def create_distance_matrix(elements, distance_function, blocks_per_process=8, matrix_path=None):
+    ''' Create the distance matrix of a list of elements in condensed format, computed in row blocks by the worker
+    pool, where distance_function(element, others) returns the distances from an element to a list of elements. The
+    matrix is written to a memory-mapped file, a temporary one if matrix_path is None, so it does not need to fit in
+    memory '''
+    size = len(elements)
+    total_pairs = size * (size - 1) / 2
+    if total_pairs == 0:
+        return np.zeros(0, dtype=np.float64)
+
+    temporary = matrix_path is None
+    if temporary:
+        handle, matrix_path = tempfile.mkstemp(suffix='.distances')
+        os.close(handle)
+
+    try:
+        condensed_matrix = open_matrix(matrix_path, total_pairs, 'w+')
+        pool = get_pool() if size > 2 else None
+        if pool is not None:
+            del condensed_matrix # each worker maps the file
+            packed_elements = pack_elements(elements)
+            blocks = split_rows(size, get_processes() * blocks_per_process)
+            tasks = [(packed_elements, distance_function, matrix_path, total_pairs, start, end) for start, end in blocks]
+            for _ in pool.imap_unordered(fill_block, tasks):
+                pass
+        else:
+            fill_rows(elements, distance_function, condensed_matrix, 0, size)
+            condensed_matrix.flush()
+            del condensed_matrix
+        condensed_matrix = open_matrix(matrix_path, total_pairs, 'r')
+    finally:
+        if temporary: # the mapping keeps the data until it is closed
+            os.remove(matrix_path)
+
+    return condensed_matrix
+
+def open_matrix(matrix_path, total_pairs, mode='r'):
+    ''' Map a condensed matrix stored in a file '''
+    return np.memmap(matrix_path, dtype=np.float64, mode=mode, shape=(total_pairs,))
+
+def create_distance_rows(sources, elements, distance_function, chunks_per_process=4):
+    ''' Create the matrix of distances from each source element to all the elements of a list, one row per source,
+    computed by the worker pool '''
+    pool = get_pool() if len(sources) > 1 else None
+    if pool is not None:
+        packed_elements = pack_elements(elements)
+        chunk_size = max(1, len(sources) / (get_processes() * chunks_per_process))
+        tasks = [(sources[x:x+chunk_size], packed_elements, distance_function) for x in xrange(0, len(sources), chunk_size)]
+        rows = [row for chunk_rows in pool.imap(fill_source_rows, tasks) for row in chunk_rows]
+    else:
+        rows = [distance_function(x, elements) for x in sources]
+
+    return np.array(rows, dtype=np.float64).reshape(len(sources), len(elements))
+
+def pack_elements(elements):
+    ''' Pickle a list of elements once for all the tasks of a matrix, with a key so that each worker unpickles it
+    only once. The frame instances are pickled as (store token, row) '''
+    return '%d-%d' % (os.getpid(), next(packed_counter)), cPickle.dumps(elements, cPickle.HIGHEST_PROTOCOL)
+
+def unpack_elements(packed_elements):
+    ''' Get the elements of a packed list, unpickling them only in the first task of a worker '''
+    key, data = packed_elements
+    if worker_elements.get('key') != key:
+        worker_elements.clear() # only the elements of the current matrix are kept
+        worker_elements['elements'] = cPickle.loads(data)
+        worker_elements['key'] = key
+
+    return worker_elements['elements']
+
+def fill_source_rows(task):
+    ''' Compute the distances from some source elements to all the elements '''
+    sources, packed_elements, distance_function = task
+    elements = unpack_elements(packed_elements)
+
+    return [distance_function(x, elements) for x in sources]
+
+def fill_block(task):
+    ''' Fill a block of rows of a matrix stored in a file '''
+    packed_elements, distance_function, matrix_path, total_pairs, start, end = task
+    condensed_matrix = open_matrix(matrix_path, total_pairs, 'r+')
+    fill_rows(unpack_elements(packed_elements), distance_function, condensed_matrix, start, end)
+    condensed_matrix.flush()
+
+def fill_rows(elements, distance_function, condensed_matrix, start, end):
+    ''' Fill the distances of rows [start, end) of a condensed matrix '''
+    size = len(elements)
+    position = row_offset(start, size)
+
+    for i in xrange(start, end):
+        condensed_matrix[position:position+size-i-1] = distance_function(elements[i], elements[i+1:])
+        position += size - i - 1
+
+def row_offset(row, size):
+    ''' Get the position of the pair (row, row+1) in a condensed matrix '''
+    return row * size - row * (row + 1) / 2
+
+def condensed_rows(condensed_matrix, rows, size, columns=None):
+    ''' Get the rows of some elements from a condensed matrix, in all the columns or only in some of them, with zeros
+    in the diagonal '''
+    rows = np.asarray(rows, dtype=np.int64)
+    columns = np.arange(size) if columns is None else np.asarray(columns, dtype=np.int64)
+
+    return condensed_distances(condensed_matrix, rows[:, np.newaxis], columns[np.newaxis, :], size)
+
+def condensed_distances(condensed_matrix, rows, columns, size):
+    ''' Get the distances of the pairs (rows[i], columns[i]) from a condensed matrix, broadcasting rows and columns '''
+    rows, columns = np.broadcast_arrays(np.asarray(rows, dtype=np.int64), np.asarray(columns, dtype=np.int64))
+    if size < 2:
+        return np.zeros(rows.shape)
+
+    first = np.minimum(rows, columns)
+    second = np.maximum(rows, columns)
+    diagonal = first == second
+    positions = first * size - first * (first + 1) / 2 + second - first - 1
+    positions[diagonal] = 0
+
+    return np.where(diagonal, 0.0, condensed_matrix[positions])
+
+def split_rows(size, num_blocks):
+    ''' Split the rows of a condensed matrix in blocks with a similar number of pairs '''
+    block_pairs = max(1, size * (size - 1) / 2 / max(1, num_blocks))
+    blocks = []
+    start = 0
+    pairs = 0
+
+    for row in xrange(size - 1):
+        pairs += size - row - 1
+        if pairs >= block_pairs:
+            blocks.append((start, row + 1))
+            start = row + 1
+            pairs = 0
+    if start < size - 1:
+        blocks.append((start, size - 1))
+
+    return blocks
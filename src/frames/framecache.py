@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*
+
+import os
+import json
+import shutil
+import logging
+import numpy as np
+from os.path import join, exists, basename, dirname, normpath
+from framestore import load_store
+
+logging.basicConfig(level=logging.DEBUG, format='%(asctime)s %(levelname)s %(message)s')
+SNAPSHOT_VERSION = 2
+
+def get_snapshot_path(all_instances_path):
+    ''' Get the folder of the snapshot of a raw folder, e.g. resource/frames/raw.snapshot '''
+    raw_path = normpath(all_instances_path)
+
+    return join(dirname(raw_path), basename(raw_path) + '.snapshot')
+
+def get_file_stats(file_path):
+    ''' Get the (size, mtime) pair used to decide if a file changed '''
+    stats = os.stat(file_path)
+
+    return stats.st_size, stats.st_mtime
+
+def load_snapshot(snapshot_path):
+    ''' Load a snapshot of parsed frame instances, returning None if it does not exist or is outdated '''
+    manifest_path = join(snapshot_path, 'manifest.json')
+    if not exists(manifest_path):
+        return None
+
+    try:
+        with open(manifest_path) as fin:
+            manifest = json.load(fin)
+        if manifest['version'] != SNAPSHOT_VERSION:
+            return None
+        snapshot = {
+            'files': {x['path']:x for x in manifest['files']},
+            'store': load_store(snapshot_path),
+            'index_keys': np.load(join(snapshot_path, 'index_keys.npy')),
+            'index_groups': np.load(join(snapshot_path, 'index_groups.npy'), mmap_mode='r')
+        }
+    except (IOError, ValueError, KeyError):
+        logging.warning('Ignoring corrupted snapshot in "%s"' % snapshot_path)
+        return None
+
+    return snapshot
+
+def save_snapshot(snapshot_path, frame_store, files, index_keys, index_groups):
+    ''' Save a snapshot of parsed frame instances, with the rows and (size, mtime) of each file and the deduplication index '''
+    temporal_path = snapshot_path + '.tmp'
+    if exists(temporal_path):
+        shutil.rmtree(temporal_path)
+    os.makedirs(temporal_path)
+
+    frame_store.save(temporal_path)
+    np.save(join(temporal_path, 'index_keys.npy'), index_keys)
+    np.save(join(temporal_path, 'index_groups.npy'), index_groups)
+    with open(join(temporal_path, 'manifest.json'), 'w') as fout:
+        json.dump({'version':SNAPSHOT_VERSION, 'files':files}, fout)
+
+    if exists(snapshot_path):
+        shutil.rmtree(snapshot_path)
+    os.rename(temporal_path, snapshot_path)
@@ -1,24 +1,98 @@
 # -*- coding: utf-8 -*
 
-class FrameElement:
+import weakref
+
+stores = weakref.WeakValueDictionary() # token -> Frame_Store, to unpickle views inside pool workers
+
+def register_store(frame_store):
+    ''' Register a store so that the views over it can be pickled as (token, position) '''
+    stores[frame_store.token] = frame_store
+
+def restore_element(token, position):
+    return FrameElement(stores[token], position)
+
+def restore_instance(token, row):
+    return FrameInstance(stores[token], row)
+
+class FrameElement(object):
     '''
-    Class that implements a frame element
+    Class that implements a frame element, as a view over an element of a Frame_Store
     '''
-    def __init__(self):
-        self.role = None
-        self.entity = None
+    __slots__ = ('store', 'position')
+
+    def __init__(self, store, position):
+        self.store = store
+        self.position = position
+
+    def __reduce__(self):
+        return (restore_element, (self.store.token, self.position))
+
+    @property
+    def role_id(self):
+        return self.store.roles[self.position]
+
+    @property
+    def entity_id(self):
+        return self.store.entities[self.position]
+
+    @property
+    def role(self):
+        return self.store.strings[self.store.roles[self.position]]
+
+    @property
+    def entity(self):
+        return self.store.entity_uri(self.position)
+
+    @property
+    def entity_name(self):
+        return self.store.strings[self.store.entities[self.position]]
 
     def __str__(self):
         return '{0}: {1}'.format(self.role, self.entity)
 
-class FrameInstance:
+class FrameInstance(object):
     '''
-    Class that implements a frame
+    Class that implements a frame, as a view over a row of a Frame_Store
     '''
-    def __init__(self, _id):
-        self.id = _id
-        self.frame_type = None
-        self.frame_elements = []
+    __slots__ = ('store', 'row')
+
+    def __init__(self, store, row):
+        self.store = store
+        self.row = row
+
+    def __reduce__(self):
+        return (restore_instance, (self.store.token, self.row))
+
+    @property
+    def id(self):
+        return self.store.instance_ids[self.row]
+
+    @property
+    def frame_type_id(self):
+        return self.store.frame_types[self.row]
+
+    @property
+    def frame_type(self):
+        return self.store.strings[self.store.frame_types[self.row]]
+
+    @property
+    def index_group(self):
+        return self.store.index_groups[self.row]
+
+    @property
+    def frame_elements(self):
+        return [FrameElement(self.store, x) for x in self.store.element_range(self.row)]
+
+    @property
+    def role_ids(self):
+        return self.store.roles[self.store.element_offsets[self.row]:self.store.element_offsets[self.row+1]]
+
+    @property
+    def entity_ids(self):
+        return self.store.entities[self.store.element_offsets[self.row]:self.store.element_offsets[self.row+1]]
+
+    def element_names(self, lowercase=False):
+        return self.store.element_names(self.row, lowercase)
 
     def __str__(self):
         return '''Frame Instance: {0}
@@ -27,4 +101,4 @@ class FrameInstance:
                 {3}'''.format(self.id,
                               self.frame_type,
                               len(self.frame_elements),
-                              '\n'.join(['\t{0}'.format(str(fe)) for fe in self.frame_elements]))
\ No newline at end of file
+                              '\n'.join(['\t{0}'.format(str(fe)) for fe in self.frame_elements]))
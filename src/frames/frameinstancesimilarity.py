@@ -1,90 +1,174 @@
 # -*- coding: utf-8 -*
 # Original code in: https://github.com/valeriobasile/deko/blob/master/src/clustering/frameinstancesimilarity.py
 import os
-import math
 import logging 
-import requests
-from nltk.corpus import framenet as fn
-from nltk.corpus import wordnet
-from scipy.spatial.distance import cosine
+import numpy as np
+from scipy.sparse import csr_matrix
+from similaritycache import Similarity_Cache
+from wordnethierarchy import load_hierarchy
+from nasari import load_nasari, get_matrix_paths
+from utils.utils import load_compiled, map_wn31wn30
 
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s %(levelname)s %(message)s')
+LEXICAL_UNITS_PATH = '../../resource/fsimilarity/frame_lexical_units.tsv'
+SEMCOR_LEMMAS_PATH = '../../resource/fsimilarity/semcor3.0_lemmas.tsv'
+FRAME_VECTORS_PATH = '../../resource/fsimilarity/frame_vectors_glove6b.txt'
+FRAME_MATRIX_PATH = '../../resource/fsimilarity/frame_vectors_glove6b.npz'
+WN30_WN31_PATH = '../../resource/mapping/wn30-31.map'
+OCCURRENCE_MATRIX_PATH = '../../resource/fsimilarity/frame_occurrence_npmi.npz'
+SYNSET_CACHE_PATH = '../../resource/fsimilarity/synset_similarity_cache.sqlite'
+WORDNET_OFFSETS_PATH = '../../resource/fsimilarity/wordnet_offsets.tsv'
+WORDNET_HIERARCHY_PATH = '../../resource/fsimilarity/wordnet_hierarchy.npz'
+NASARI_VECTORS_PATH = '../../resource/fsimilarity/nasari_embed_english.txt'
+NASARI_MATRIX_PATH = '../../resource/fsimilarity/nasari_embed_english'
+CACHED_MEASURES = ['dist'] # the Wu-Palmer similarity of many pairs is computed faster than it is read from the cache
+RESOURCES = { # attribute -> method that loads it
+    'lexical_units': 'load_lexical_units',
+    'semcor_lemmas': 'load_semcor_lemmas',
+    'semcor_sentences': 'load_semcor_lemmas',
+    'wn31wn30': 'load_wn31wn30',
+    'wordnet_hierarchy': 'load_wordnet_hierarchy',
+    'frame_vectors': 'load_frame_vectors',
+    'frame_vector_index': 'load_frame_vectors',
+    'nasari_vectors': 'load_nasari_vectors'
+}
 
 class Frame_Similarity:
 
     def __init__(self):
         self.__cache_frames = {}
-        self.__cache_synsets = {}
-        self.load_resources()
+        self.__cache_synsets = Similarity_Cache(get_path(SYNSET_CACHE_PATH))
+        self.__occurrence_matrix = None
+        self.__occurrence_frames = None
+        self.__vector_similarities = None
+
+    def __getattr__(self, name):
+        """Load the resources the first time that a measure uses them"""
+        if name not in RESOURCES:
+            raise AttributeError(name)
+        getattr(self, RESOURCES[name])()
+
+        return self.__dict__[name]
+
+    def load_resources(self, ftsim='occ', fesim='wup'):
+        """Load at once the resources of a frame type and a frame element measure,
+        e.g. before starting the worker processes that use them"""
+        if ftsim == 'occ' and self.__occurrence_matrix is None:
+            self.__occurrence_matrix, self.__occurrence_frames = self.load_occurrence_matrix()
+        elif ftsim == 'dist':
+            self.frame_vectors
+        if fesim == 'wup':
+            self.wordnet_hierarchy, self.wn31wn30
+        elif fesim == 'dist':
+            self.nasari_vectors
+
+    def get_resource_paths(self, ftsim='occ', fesim='wup'):
+        """Get the files that the resources of a frame type and a frame element
+        measure are loaded from, e.g. to know if they were built again"""
+        paths = []
+        if ftsim == 'occ':
+            paths.append(OCCURRENCE_MATRIX_PATH)
+        elif ftsim == 'dist':
+            paths.append(FRAME_MATRIX_PATH)
+        if fesim == 'wup':
+            paths.extend([WORDNET_HIERARCHY_PATH, WN30_WN31_PATH])
+        elif fesim == 'dist':
+            paths.extend(get_matrix_paths(NASARI_MATRIX_PATH))
+
+        return [get_path(x) for x in paths]
 
-    def load_resources(self):
-        # read the lexical units dictionary
+    def load_lexical_units(self):
         logging.info("reading FrameNet lexical units")
-        self.lexical_units = dict()
-        with open(os.path.join(os.path.dirname(__file__), "../../resource/fsimilarity/frame_lexical_units.tsv")) as f:
+        self.lexical_units = load_compiled(get_path(LEXICAL_UNITS_PATH) + '.pkl', [get_path(LEXICAL_UNITS_PATH)], self.read_lexical_units)
+
+    def read_lexical_units(self):
+        lexical_units = dict()
+        with open(get_path(LEXICAL_UNITS_PATH)) as f:
             for line in f:
                 frame, lu = line.rstrip().split('\t')
-                if not frame in self.lexical_units:
-                    self.lexical_units[frame] = []
-                self.lexical_units[frame].append(lu)
+                if not frame in lexical_units:
+                    lexical_units[frame] = []
+                lexical_units[frame].append(lu)
+
+        return lexical_units
 
-        # read Semcor lemmas:
+    def load_semcor_lemmas(self):
         logging.info("reading Semcor 3.0 lemmas")
-        self.semcor_lemmas = dict()
-        self.semcor_sentences = dict()
-        with open(os.path.join(os.path.dirname(__file__), "../../resource/fsimilarity/semcor3.0_lemmas.tsv")) as f:
+        self.semcor_lemmas, self.semcor_sentences = load_compiled(get_path(SEMCOR_LEMMAS_PATH) + '.pkl', [get_path(SEMCOR_LEMMAS_PATH)], self.read_semcor_lemmas)
+
+    def read_semcor_lemmas(self):
+        semcor_lemmas = dict()
+        semcor_sentences = dict()
+        with open(get_path(SEMCOR_LEMMAS_PATH)) as f:
             for line in f:
                 sentence_id, lemma, sense = line.rstrip().split('\t')
 
-                if not sentence_id in self.semcor_lemmas:
-                    self.semcor_lemmas[sentence_id] = []
-                self.semcor_lemmas[sentence_id].append(lemma)
+                if not sentence_id in semcor_lemmas:
+                    semcor_lemmas[sentence_id] = []
+                semcor_lemmas[sentence_id].append(lemma)
 
-                if not lemma in self.semcor_sentences:
-                    self.semcor_sentences[lemma] = []
-                self.semcor_sentences[lemma].append(sentence_id)
+                if not lemma in semcor_sentences:
+                    semcor_sentences[lemma] = []
+                semcor_sentences[lemma].append(sentence_id)
 
+        return semcor_lemmas, semcor_sentences
+
+    def load_wn31wn30(self):
         # Mapping different WN versions
         logging.info("reading WordNet 3.0-3.1 mapping")
-        self.wn31wn30 = dict()
-        with open(os.path.join(os.path.dirname(__file__), '../../resource/mapping/wn30-31.map')) as f:
-            for line in f:
-                wn30, wn31 = line.rstrip().split(' ')
-                self.wn31wn30[wn31] = wn30
+        self.wn31wn30 = load_compiled(get_path(WN30_WN31_PATH) + '.pkl', [get_path(WN30_WN31_PATH)], map_wn31wn30)
 
-        # creating dictionary of Wordnet synset id (offsets)
-        logging.info("reading WordNet 3.0 offset-id mapping")
-        self.offset2name = dict()
-        with open(os.path.join(os.path.dirname(__file__), "../../resource/fsimilarity/wordnet_offsets.tsv")) as f:
-            for line in f:
-                offset, name = line.rstrip().split('\t')
-                self.offset2name[offset] = name
+    def load_wordnet_hierarchy(self):
+        # hypernym hierarchy of the Wordnet synset ids (offsets)
+        logging.info("reading WordNet 3.0 hierarchy")
+        self.wordnet_hierarchy = load_hierarchy(get_path(WORDNET_HIERARCHY_PATH), get_path(WORDNET_OFFSETS_PATH))
 
+    def load_frame_vectors(self):
+        """Load the frame vectors as a matrix of normalized rows and a dictionary
+        from frame type to row, converting the vector file if it is newer."""
         logging.info("loading frame vectors")
-        frame_vectors = self.read_vector_file(os.path.join(os.path.dirname(__file__), '../../resource/fsimilarity/frame_vectors_glove6b.txt'))
+        matrix_path = get_path(FRAME_MATRIX_PATH)
+        vectors_path = get_path(FRAME_VECTORS_PATH)
+
+        if os.path.exists(matrix_path) and os.path.getmtime(matrix_path) >= os.path.getmtime(vectors_path):
+            with np.load(matrix_path) as data:
+                vectors = data['vectors']
+                frames = data['frames'].tolist()
+        else:
+            frames, vectors = self.read_vector_file(vectors_path)
+            norms = np.linalg.norm(vectors, axis=1)
+            vectors /= np.where(norms > 0, norms, 1)[:, np.newaxis]
+            np.savez(matrix_path, vectors=vectors, frames=np.array(frames))
+
+        self.frame_vectors = vectors
+        self.frame_vector_index = {frame:i for i, frame in enumerate(frames)}
 
     def read_vector_file(self, vector_file):
-        f = open(vector_file,'r')
-        model = {}
-        for line in f:
-            splitLine = line.split()
-            word = splitLine[0]
-            embedding = [float(val) for val in splitLine[1:]]
-            model[word] = embedding
-        return model
+        """Output: the words of a vector file in text format and a matrix with their vectors"""
+        words = []
+        vectors = []
+        with open(vector_file) as f:
+            for line in f:
+                splitLine = line.split()
+                words.append(splitLine[0])
+                vectors.append(np.array(splitLine[1:], dtype=np.float64))
 
-    def nasari_similarity(self, e1, e2):# for babelnet
-        e1 = "bn:{0}".format(e1[1:])
-        e2 = "bn:{0}".format(e2[1:])
-        if e1 == e2:
-            return 1.0
+        return words, np.array(vectors, dtype=np.float64).reshape(len(words), -1)
+
+    def load_nasari_vectors(self):
+        logging.info("loading NASARI vectors")
+        self.nasari_vectors = load_nasari(get_path(NASARI_MATRIX_PATH), get_path(NASARI_VECTORS_PATH))
 
-        result = requests.get('http://localhost:5000/nasari/cosine?key1=%s&key2=%s' % (e1, e2)).json()
+    def nasari_similarity(self, e1, e2):# for babelnet
+        return self.nasari_similarity_batch([e1], [e2])[0]
 
-        if 'similarity' in result:
-            return result['similarity']
+    def nasari_similarity_batch(self, synsetids1, synsetids2):
+        """Input: two lists of synset ids, e.g, ['s00046516n', ...]
+        Output: an array with the cosine similarity of the NASARI vectors of each pair"""
+        keys1 = ["bn:{0}".format(x[1:]) for x in synsetids1]
+        keys2 = ["bn:{0}".format(x[1:]) for x in synsetids2]
 
-        return 0
+        return self.nasari_vectors.cosine_similarity(keys1, keys2)
 
     def frame_relatedness(self, frame1, frame2, ftsim='occ'):
         """Compute the relatedness between two frame types, using one of the
@@ -100,110 +184,215 @@ class Frame_Similarity:
             return self.ftsim_dist(frame1, frame2)
 
     def ftsim_dist(self, frame1, frame2):
-        v1 = frame_vectors[frame1]
-        v2 = frame_vectors[frame2]
-        return 1.0 - cosine(v1, v2)
+        """Cosine similarity of the vectors of two frame types, looked up in the
+        matrix of all pairs, which is computed the first time."""
+        if self.__vector_similarities is None:
+            self.__vector_similarities = np.dot(self.frame_vectors, self.frame_vectors.T)
+
+        return self.__vector_similarities[self.frame_vector_index[frame1], self.frame_vector_index[frame2]]
 
     def cr_occ(self, frame1, frame2):
         """This is an implementation of the first co-occurrence measure of
         Pennacchiotti and Wirth (ACL2009), described in Sec. 4.2.1 of the paper.
         Input: two frame type names, e.g., Commerce_buy/Commerce_sell.
         Output: a real number (Pointwise-mutual information)."""
-        
-        lus1 = self.lexical_units[frame1]
-        lus2 = self.lexical_units[frame2]
-
-        '''Set of the contexts (sentences in Semcor 3.0) where the lexical units
-        of frame1 occur'''
-        cf1 = set()
-        for lu in lus1:
-            if lu in self.semcor_sentences:
-                cf1 = cf1.union(set(self.semcor_sentences[lu]))
-
-        '''Set the contexts (sentences in Semcor 3.0) where the lexical units
-        of frame2 occur'''
-        cf2 = set()
-        for lu in lus2:
-            if lu in self.semcor_sentences:
-                cf2 = cf2.union(set(self.semcor_sentences[lu]))
-
-        '''Set of the contexts where lexical units from both frames co-occur'''
-        cf12 = cf1.intersection(cf2)
+        if self.__occurrence_matrix is None:
+            self.__occurrence_matrix, self.__occurrence_frames = self.load_occurrence_matrix()
+
+        return self.__occurrence_matrix[self.__occurrence_frames[frame1], self.__occurrence_frames[frame2]]
+
+    def load_occurrence_matrix(self):
+        """Load the cr_occ values of all pairs of frame types, building and saving
+        them if the file does not exist or is older than its sources.
+        Output: the matrix and a dictionary from frame type to row."""
+        matrix_path = get_path(OCCURRENCE_MATRIX_PATH)
+        source_paths = [get_path(x) for x in [LEXICAL_UNITS_PATH, SEMCOR_LEMMAS_PATH]]
+
+        if os.path.exists(matrix_path) and all(os.path.getmtime(matrix_path) >= os.path.getmtime(x) for x in source_paths):
+            with np.load(matrix_path) as data:
+                matrix = data['matrix']
+                frames = data['frames'].tolist()
+        else:
+            logging.info("building the frame co-occurrence matrix")
+            matrix, frames = self.build_occurrence_matrix()
+            np.savez(matrix_path, matrix=matrix, frames=np.array(frames))
+
+        return matrix, {frame:i for i, frame in enumerate(frames)}
+
+    def build_occurrence_matrix(self):
+        """Compute cr_occ for all pairs of frame types at once.
+        Output: the matrix of normalized PMI values and the frame type of each row."""
+        frames = sorted(self.lexical_units)
+        lemma_index = {lemma:i for i, lemma in enumerate(self.semcor_sentences)}
+        sentence_index = {sentence_id:i for i, sentence_id in enumerate(self.semcor_lemmas)}
+
+        '''Incidence of the lexical units of each frame in the Semcor 3.0 lemmas'''
+        rows, columns = [], []
+        for i, frame in enumerate(frames):
+            for lu in set(self.lexical_units[frame]):
+                if lu in lemma_index:
+                    rows.append(i)
+                    columns.append(lemma_index[lu])
+        frame_lemma = csr_matrix((np.ones(len(rows)), (rows, columns)), shape=(len(frames), len(lemma_index)))
+
+        '''Incidence of the lemmas in the contexts (sentences in Semcor 3.0)'''
+        rows, columns = [], []
+        for lemma, sentence_ids in self.semcor_sentences.items():
+            for sentence_id in set(sentence_ids):
+                rows.append(lemma_index[lemma])
+                columns.append(sentence_index[sentence_id])
+        lemma_sentence = csr_matrix((np.ones(len(rows)), (rows, columns)), shape=(len(lemma_index), len(sentence_index)))
+
+        '''Set of the contexts where the lexical units of each frame occur, as a binary
+        frame x sentence matrix, whose product with itself counts the contexts where
+        lexical units from both frames co-occur'''
+        frame_sentence = (frame_lemma * lemma_sentence).astype(bool).astype(np.float64)
+        cf12 = (frame_sentence * frame_sentence.T).toarray()
+        cf = cf12.diagonal()
 
         '''Compute the Normalized Point-wise Mutual Information'''
-        l1 = float(len(cf1))/float(len(self.semcor_lemmas))
-        l2 = float(len(cf2))/float(len(self.semcor_lemmas))
-        l12 = float(len(cf12))/float(len(self.semcor_lemmas))
-        if l12 == 0.0 or l1 == 0.0 or l2 == 0.0:
-            return 0.0
-        else:
-            #return (math.log(l12/(l1*l2), 2.0))/(-math.log(l12, 2.0))
-            x = (math.log(l12/(l1*l2), 2.0))/(-math.log(l12, 2.0))
-            normalized = (x+1)/2.0 # Normalized between [0,1] = (x-min(x))/(max(x)-min(x))
-            return normalized
+        l1l2 = np.outer(cf, cf) / float(len(self.semcor_lemmas)) ** 2
+        l12 = cf12 / float(len(self.semcor_lemmas))
+        matrix = np.zeros(l12.shape)
+        valid = (l12 > 0.0) & (l12 < 1.0)
+        x = np.log2(l12[valid] / l1l2[valid]) / -np.log2(l12[valid])
+        matrix[valid] = (x + 1) / 2.0 # Normalized between [0,1] = (x-min(x))/(max(x)-min(x))
+        matrix[l12 == 1.0] = 1.0
+
+        return matrix, frames
 
     def wup_similarity(self, s1, s2):
-        synset1 = wordnet.synset(self.offset2name[s1])
-        synset2 = wordnet.synset(self.offset2name[s2])
-        result = synset1.wup_similarity(synset2)
+        return self.wup_similarity_batch([s1], [s2])[0]
+
+    def wup_similarity_batch(self, synsets1, synsets2):
+        """Input: two lists of WordNet 3.0 offsets, e.g, ['02084071-n', ...]
+        Output: an array with the Wu-Palmer similarity of each pair"""
+        ids1 = self.wordnet_hierarchy.get_ids(synsets1)
+        ids2 = self.wordnet_hierarchy.get_ids(synsets2)
 
-        return result if result is not None else 0.0
+        return self.wordnet_hierarchy.wup_similarity(ids1, ids2)
 
     def synset_similarity(self, e1, e2, fesim='wup'):# for wordnet
         """Input: two concept URI, e.g, '<http://babelnet.org/rdf/s00046516n>?'
         Output: a real number between 0.0 and 1.0"""
-        value_from_cache = self.get_from_cache(e1, e2, self.__cache_synsets) 
-        if value_from_cache is not None:
-            return value_from_cache
+        if e1 == e2:
+            return 1.0
 
         synsetid1 = e1[1:-1].split('/')[-1]
         synsetid2 = e2[1:-1].split('/')[-1]
 
+        return self.cached_similarity(synsetid1, synsetid2, fesim=fesim)
+
+    def cached_similarity(self, synsetid1, synsetid2, fesim='wup'):
+        """Input: two synset ids, e.g, 's00046516n'
+        Output: a real number between 0.0 and 1.0, read from the cache if it was already computed"""
+        value_from_cache = self.__cache_synsets.get(fesim, synsetid1, synsetid2)
+        if value_from_cache is not None:
+            return value_from_cache
+
+        if fesim == 'wup':
+            sim = self.wup_similarity(self.wn31wn30[synsetid1], self.wn31wn30[synsetid2])
+        elif fesim == 'dist':
+            sim = self.nasari_similarity(synsetid1, synsetid2)
+        self.__cache_synsets.set(fesim, synsetid1, synsetid2, sim)
+
+        return sim
+
+    def synset_similarity_batch(self, synsetids1, synsetids2, fesim='wup'):
+        """Input: two lists of synset ids, e.g, ['s00046516n', ...]
+        Output: an array with the similarity of each pair, between 0.0 and 1.0,
+        read from the cache for the measures in CACHED_MEASURES"""
+        similarities = np.ones(len(synsetids1))
+        different = [i for i, (x, y) in enumerate(zip(synsetids1, synsetids2)) if x != y]
+        pairs = [(synsetids1[i], synsetids2[i]) for i in different]
+        missing = range(len(pairs))
+        if fesim in CACHED_MEASURES and pairs:
+            cached = self.__cache_synsets.get_many(fesim, pairs)
+            missing = [i for i, x in enumerate(cached) if x is None]
+            similarities[different] = [1.0 if x is None else x for x in cached]
+        if not missing:
+            return similarities
+
+        computed_pairs = [pairs[i] for i in missing]
         if fesim == 'wup':
-            return self.wup_similarity(self.wn31wn30[synsetid1], self.wn31wn30[synsetid2])
+            computed = self.wup_similarity_batch([self.wn31wn30[x] for x, _ in computed_pairs],
+                                                 [self.wn31wn30[y] for _, y in computed_pairs])
         elif fesim == 'dist':
-            return self.nasari_similarity(synsetid1, synsetid2)
+            computed = self.nasari_similarity_batch([x for x, _ in computed_pairs], [y for _, y in computed_pairs])
+        similarities[[different[i] for i in missing]] = computed
+        if fesim in CACHED_MEASURES:
+            self.__cache_synsets.set_many(fesim, computed_pairs, computed)
+
+        return similarities
+
+    def element_similarity_matrix(self, entities1, entities2, fesim='wup', strings=None):
+        """Computes the similarity of the entities of each pair of frame elements,
+        once for each pair of distinct entities.
+        Input: two arrays of entity names, or of their ids in a list of strings
+        Output: a |entities1| x |entities2| matrix"""
+        names1, inverse1 = np.unique(entities1, return_inverse=True)
+        names2, inverse2 = np.unique(entities2, return_inverse=True)
+        names1 = [strings[x] for x in names1] if strings is not None else names1.tolist()
+        names2 = [strings[x] for x in names2] if strings is not None else names2.tolist()
+
+        pairs1 = [x for x in names1 for _ in names2]
+        pairs2 = names2 * len(names1)
+        similarities = self.synset_similarity_batch(pairs1, pairs2, fesim=fesim).reshape(len(names1), len(names2))
+
+        return similarities[inverse1][:, inverse2]
+
+    def element_relatedness_bulk(self, roles1, entities1, roles2, entities2, sizes, roles=False, fesim='wup', strings=None):
+        """Computes frame_element_relatedness between some frame elements and several
+        groups of frame elements, which are concatenated in roles2 and entities2.
+        Input: the roles and entities of the elements, and the size of each group
+        Output: an array with a real number between 0.0 and 1.0 for each group"""
+        sizes = np.asarray(sizes, dtype=np.int64)
+        relatedness = np.zeros(len(sizes))
+        nonempty = np.flatnonzero(sizes > 0)
+        if len(entities1) == 0 or len(nonempty) == 0:
+            return relatedness
+
+        matrix = self.element_similarity_matrix(entities1, entities2, fesim=fesim, strings=strings)
+        if roles == True:
+            matrix[np.asarray(roles1)[:, np.newaxis] != np.asarray(roles2)[np.newaxis, :]] = 0.0
+        matrix = np.maximum(matrix, 0.0)
+
+        starts = (np.cumsum(sizes) - sizes)[nonempty]
+        sim1 = np.maximum.reduceat(matrix, starts, axis=1).mean(axis=0) # best match of each element of fe1
+        sim2 = np.add.reduceat(matrix.max(axis=0), starts) / sizes[nonempty] # best match of each element of fe2
+        relatedness[nonempty] = (sim1 + sim2) / 2.0
+
+        return relatedness
 
     def frame_element_relatedness(self, fe1, fe2, roles=False, fesim='dist'):
         """Computes an aggregate measure of relatedness between the entities
         involved in the frame elements.
         Input: two frame elements
         Output: a real number between 0.0 and 1.0"""
-        sims1 = []
-        for s1 in fe1:
-            max_sim = 0.0
-            for s2 in fe2:
-                if roles == True and s1.role != s2.role:
-                    sim = 0.0
-                else:
-                    sim = self.synset_similarity(s1.entity, s2.entity, fesim=fesim)
-                if sim > max_sim:
-                    max_sim = sim
-            sims1.append(max_sim)
-
-        if len(sims1) > 0:
-            sim1 = sum(sims1)/float(len(sims1))
-        else:
-            sim1 = 0.0
-
-        sims2 = []
-        for s2 in fe2:
-            max_sim = 0.0
-            for s1 in fe1:
-                if roles == True and s1.role != s2.role:
-                    sim = 0.0
-                else:
-                    sim = self.synset_similarity(s1.entity, s2.entity, fesim=fesim)
-                if sim > max_sim:
-                    max_sim = sim
-            sims2.append(max_sim)
-
-        if len(sims2) > 0:
-            sim2 = sum(sims2)/float(len(sims2))
-        else:
-            sim2 = 0.0      
-
-        return (sim1+sim2)/2.0
+        return self.element_relatedness_bulk([x.role for x in fe1], [x.entity_name for x in fe1],
+                                             [x.role for x in fe2], [x.entity_name for x in fe2],
+                                             [len(fe2)], roles=roles, fesim=fesim)[0]
+
+    def frame_element_relatedness_bulk(self, fi1, fis2, roles=False, fesim='dist'):
+        """Computes frame_element_relatedness between the frame elements of a frame
+        instance and those of each instance in a list, with a single similarity matrix.
+        Input: a frame instance and a list of frame instances
+        Output: an array with a real number between 0.0 and 1.0 for each instance"""
+        store = fi1.store
+        if all(x.store is store for x in fis2): # use the ids of the store instead of the strings
+            positions1, _ = store.element_positions([fi1.row])
+            positions2, sizes = store.element_positions([x.row for x in fis2])
+            return self.element_relatedness_bulk(store.roles[positions1], store.entities[positions1],
+                                                 store.roles[positions2], store.entities[positions2],
+                                                 sizes, roles=roles, fesim=fesim, strings=store.strings)
+
+        elements1 = fi1.element_names()
+        elements2 = [x.element_names() for x in fis2]
+        sizes = [len(x) for x in elements2]
+        elements2 = [x for elements in elements2 for x in elements]
+        return self.element_relatedness_bulk([r for r, e in elements1], [e for r, e in elements1],
+                                             [r for r, e in elements2], [e for r, e in elements2],
+                                             sizes, roles=roles, fesim=fesim)
 
     def frame_instance_similarity(self, fi1, fi2, alpha=0.40, roles=False, ftsim='occ', fesim='wup'):
         # the alpha prameter will be read from a config file
@@ -213,6 +402,18 @@ class Frame_Similarity:
 
         return sim
 
+    def frame_instance_similarity_bulk(self, fi1, fis2, alpha=0.40, roles=False, ftsim='occ', fesim='wup'):
+        """Computes frame_instance_similarity between a frame instance and each
+        instance in a list.
+        Output: an array with the similarity of each pair"""
+        frame_sims = {}
+        for frame_type in set(x.frame_type for x in fis2):
+            frame_sims[frame_type] = self.frame_relatedness(fi1.frame_type, frame_type, ftsim=ftsim)
+        frame_sim = np.array([frame_sims[x.frame_type] for x in fis2], dtype=np.float64)
+        fe_sim = self.frame_element_relatedness_bulk(fi1, fis2, roles=roles, fesim=fesim)
+
+        return alpha * frame_sim + (1.0-alpha) * fe_sim
+
     def get_from_cache(self, item1, item2, cache):
         if item1 == item2:
             return 1.0
@@ -223,6 +424,6 @@ class Frame_Similarity:
         else:
             return None
 
-    def set_caches(self, cache_frames, cache_synsets):
-        self.__cache_frames = cache_frames
-        self.__cache_synsets = cache_synsets
+def get_path(resource_path):
+    ''' Get the path of a resource relative to this module '''
+    return os.path.join(os.path.dirname(__file__), resource_path)
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*
+
+import os
+import json
+import hashlib
+import itertools
+import numpy as np
+from array import array
+from frameinstance import FrameInstance, register_store
+
+store_counter = itertools.count()
+COLUMNS = ['frame_types', 'element_offsets', 'roles', 'namespaces', 'entities']
+
+class Frame_Store:
+    '''
+    Class that implements a columnar store of frame instances, whose frame types, roles and entities are
+    integer ids of an interned string table
+    '''
+
+    def __init__(self, strings=None):
+        self.token = '%d-%d' % (os.getpid(), next(store_counter))
+        self.strings = list(strings) if strings else [] # string id -> string
+        self.string_ids = None # string -> string id, built on the first call to intern
+        self.instance_ids = [] # row -> frame instance id
+        self.frame_types = array('i') # row -> string id of the frame type
+        self.element_offsets = array('l', [0]) # elements of row i are in [element_offsets[i], element_offsets[i+1])
+        self.roles = array('i') # element -> string id of the role
+        self.namespaces = array('i') # element -> string id of the entity namespace, e.g. '<http://wordnet-rdf.princeton.edu/wn31/'
+        self.entities = array('i') # element -> string id of the entity name, e.g. '05760918-n'
+        self.index_groups = None # row -> group of the rows with the same frame type and entities, set by the reader
+        self.__lowercase = {}
+        register_store(self)
+
+    def __len__(self):
+        return len(self.instance_ids)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['string_ids'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        register_store(self)
+
+    def intern(self, string):
+        ''' Get the id of a string, adding it to the string table if it is new '''
+        if self.string_ids is None:
+            self.string_ids = {x:i for i, x in enumerate(self.strings)}
+        string_id = self.string_ids.get(string)
+        if string_id is None:
+            string_id = len(self.strings)
+            self.string_ids[string] = string_id
+            self.strings.append(string)
+
+        return string_id
+
+    def lowercase(self, string_id):
+        ''' Get the lowercase version of an interned string '''
+        string = self.__lowercase.get(string_id)
+        if string is None:
+            string = self.strings[string_id].lower()
+            self.__lowercase[string_id] = string
+
+        return string
+
+    def add_instance(self, instance_id, frame_type, elements):
+        ''' Add a frame instance with its (role, entity URI) elements, returning its row '''
+        row = len(self.instance_ids)
+        self.instance_ids.append(instance_id)
+        self.frame_types.append(self.intern(frame_type))
+
+        for role, entity in elements:
+            split_index = entity.rfind('/') + 1
+            self.roles.append(self.intern(role))
+            self.namespaces.append(self.intern(entity[:split_index]))
+            self.entities.append(self.intern(entity[split_index:-1]))
+        self.element_offsets.append(len(self.roles))
+
+        return row
+
+    def string_mapping(self, frame_store):
+        ''' Get the ids in this store of all the strings of another store '''
+        return np.array([self.intern(x) for x in frame_store.strings], dtype=np.int32)
+
+    def extend(self, frame_store, start=0, end=None, mapping=None):
+        ''' Append the instances in rows [start, end) of another store, returning the rows where they were added '''
+        end = len(frame_store) if end is None else end
+        first_row = len(self.instance_ids)
+        mapping = self.string_mapping(frame_store) if mapping is None else mapping
+        offsets = np.asarray(frame_store.element_offsets[start:end+1])
+        first_element, last_element = offsets[0], offsets[-1]
+        self.instance_ids.extend(frame_store.instance_ids[start:end])
+        append_array(self.frame_types, mapping[np.asarray(frame_store.frame_types[start:end])])
+        append_array(self.roles, mapping[np.asarray(frame_store.roles[first_element:last_element])])
+        append_array(self.namespaces, mapping[np.asarray(frame_store.namespaces[first_element:last_element])])
+        append_array(self.entities, mapping[np.asarray(frame_store.entities[first_element:last_element])])
+        append_array(self.element_offsets, offsets[1:] - first_element + self.element_offsets[-1])
+
+        return xrange(first_row, len(self.instance_ids))
+
+    def compact(self):
+        ''' Convert the columns to NumPy arrays once no more instances are going to be added '''
+        self.frame_types = to_numpy(self.frame_types)
+        self.element_offsets = to_numpy(self.element_offsets)
+        self.roles = to_numpy(self.roles)
+        self.namespaces = to_numpy(self.namespaces)
+        self.entities = to_numpy(self.entities)
+
+    def save(self, store_path):
+        ''' Save the store in a folder, one .npy file per column so that they can be memory-mapped '''
+        self.compact()
+        for column in COLUMNS:
+            np.save(os.path.join(store_path, column + '.npy'), getattr(self, column))
+        with open(os.path.join(store_path, 'strings.json'), 'w') as fout:
+            json.dump({'strings':self.strings, 'instance_ids':self.instance_ids}, fout)
+
+    def instance(self, row):
+        ''' Get a frame instance view of a row '''
+        return FrameInstance(self, row)
+
+    def element_range(self, row):
+        ''' Get the positions of the elements of a row '''
+        return xrange(self.element_offsets[row], self.element_offsets[row+1])
+
+    def element_positions(self, rows):
+        ''' Get the positions of the elements of several rows, concatenated, and the number of elements of each row '''
+        rows = np.asarray(rows, dtype=np.int64)
+        offsets = np.asarray(self.element_offsets)
+        starts = offsets[rows]
+        counts = offsets[rows + 1] - starts
+        positions = expand_ranges(starts, counts)
+
+        return positions, counts
+
+    def element_names(self, row, lowercase=False):
+        ''' Get the (role, entity name) pairs of a row directly from the string table '''
+        start, end = self.element_offsets[row], self.element_offsets[row+1]
+        roles = self.roles[start:end].tolist()
+        entities = self.entities[start:end].tolist()
+        get_role = self.lowercase if lowercase else self.strings.__getitem__
+
+        return [(get_role(r), self.strings[e]) for r, e in zip(roles, entities)]
+
+    def dedup_keys(self):
+        ''' Compute a 64-bit key for each row from its frame type and the multiset of its entity names, so that
+        repeated instances get the same key whatever the order of their elements '''
+        string_hashes = np.array([hash_string(x) for x in self.strings], dtype=np.uint64)
+        offsets = np.asarray(self.element_offsets)
+        entity_sums = np.zeros(len(self.entities) + 1, dtype=np.uint64)
+        np.cumsum(mix64(string_hashes[np.asarray(self.entities)]), out=entity_sums[1:]) # uint64 sums wrap around
+        row_sums = entity_sums[offsets[1:]] - entity_sums[offsets[:-1]]
+
+        return mix64(mix64(string_hashes[np.asarray(self.frame_types)]) + row_sums)
+
+    def entity_uri(self, position):
+        ''' Rebuild the full URI of the entity of an element '''
+        return '%s%s>' % (self.strings[self.namespaces[position]], self.strings[self.entities[position]])
+
+def load_store(store_path, mmap_mode='r'):
+    ''' Load a store saved with Frame_Store.save, memory-mapping its columns '''
+    with open(os.path.join(store_path, 'strings.json')) as fin:
+        data = json.load(fin)
+    frame_store = Frame_Store(data['strings'])
+    frame_store.instance_ids = data['instance_ids']
+    for column in COLUMNS:
+        setattr(frame_store, column, np.load(os.path.join(store_path, column + '.npy'), mmap_mode=mmap_mode))
+
+    return frame_store
+
+def dedup_key(frame_type, entity_names):
+    ''' Compute the deduplication key of a single instance, the same than Frame_Store.dedup_keys '''
+    entity_hashes = mix64(np.array([hash_string(x) for x in entity_names], dtype=np.uint64))
+    frame_hash = mix64(np.array([hash_string(frame_type)], dtype=np.uint64))
+
+    return int(mix64(frame_hash + entity_hashes.sum(dtype=np.uint64))[0])
+
+def hash_string(string):
+    ''' Get a 64-bit hash of a string that is the same in every process and run '''
+    return int(hashlib.md5(string.encode('utf-8')).hexdigest()[:16], 16)
+
+def mix64(values):
+    ''' Mix the bits of 64-bit integers (the splitmix64 finalizer) '''
+    values = values ^ (values >> np.uint64(30))
+    values = values * np.uint64(0xbf58476d1ce4e5b9)
+    values = values ^ (values >> np.uint64(27))
+    values = values * np.uint64(0x94d049bb133111eb)
+
+    return values ^ (values >> np.uint64(31))
+
+def expand_ranges(starts, counts):
+    ''' Concatenate the ranges [starts[i], starts[i] + counts[i]), e.g. the positions of the rows of a CSR layout '''
+    return np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(starts, counts)
+
+def append_array(column, values):
+    ''' Append NumPy values to an array column without iterating in Python '''
+    column.fromstring(np.ascontiguousarray(values, dtype=column.typecode).tostring())
+
+def to_numpy(column):
+    ''' Convert an array column to a NumPy array '''
+    if isinstance(column, np.ndarray):
+        return column
+
+    return np.frombuffer(column, dtype=column.typecode).copy()
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*
+
+from heapq import heappush, heappop
+
+class Space_Saving:
+    '''
+    Class that implements the Space-Saving algorithm (Metwally et al., 2005), which finds the most frequent items of
+    a stream with a fixed number of counters. When all the counters are in use, a new item replaces the item with the
+    lowest count and inherits it, so the counts are upper bounds with an error of at most total / capacity. Each item
+    keeps the representative it was added with, e.g. the first frame instance of a group of repeated instances.
+    '''
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.total = 0
+        self.counters = {} # item -> [count, error, arrival, representative]
+        self.__heap = [] # one (count, item) entry per item, whose count is updated when it reaches the top
+
+    def add(self, item, representative=None):
+        ''' Count an occurrence of an item '''
+        self.total += 1
+        counter = self.counters.get(item)
+        if counter is not None:
+            counter[0] += 1
+            return
+
+        error = 0
+        if len(self.counters) >= self.capacity:
+            error = self.counters.pop(self.pop_minimum())[0]
+        self.counters[item] = [error + 1, error, self.total, representative]
+        heappush(self.__heap, (error + 1, item))
+
+    def pop_minimum(self):
+        ''' Remove the item with the lowest count from the heap and return it '''
+        while True:
+            count, item = heappop(self.__heap)
+            if self.counters[item][0] == count:
+                return item
+            heappush(self.__heap, (self.counters[item][0], item)) # its count grew since it was pushed
+
+    def top(self, k):
+        ''' Get the (item, count, error, representative) of the k items with the highest counts, the first to
+        arrive if there is a tie '''
+        counters = sorted(self.counters.items(), key=lambda x: (-x[1][0], x[1][2]))[:k]
+
+        return [(item, count, error, representative) for item, (count, error, _, representative) in counters]
@@ -1,65 +1,152 @@
+# -*- coding: utf-8 -*
+
 import numpy as np
-import random
-#Original code in: https://github.com/letiantian/kmedoids/blob/master/kmedoids.py
-def kMedoids(D, k, tmax=100):
-    # determine dimensions of distance matrix D
-    m, n = D.shape
-
-    if k > n:
-        raise Exception('too many medoids')
-
-    # find a set of valid initial cluster medoid indices since we
-    # can't seed different clusters with two points at the same location
-    valid_medoid_inds = set(range(n))
-    invalid_medoid_inds = set([])
-    rs,cs = np.where(D==0)
-    # the rows, cols must be shuffled because we will keep the first duplicate below
-    index_shuf = range(len(rs))
-    np.random.shuffle(index_shuf)
-    rs = rs[index_shuf]
-    cs = cs[index_shuf]
-    for r,c in zip(rs,cs):
-        # if there are two points with a distance of 0...
-        # keep the first one for cluster init
-        if r < c and r not in invalid_medoid_inds:
-            invalid_medoid_inds.add(c)
-    valid_medoid_inds = list(valid_medoid_inds - invalid_medoid_inds)
-
-    if k > len(valid_medoid_inds):
-        k = len(valid_medoid_inds) / 4
-        #raise Exception('too many medoids (after removing {} duplicate points)'.format(
-        #    len(invalid_medoid_inds)))
-
-    # randomly initialize an array of k medoid indices
-    M = np.array(valid_medoid_inds)
-    np.random.shuffle(M)
-    M = np.sort(M[:k])
-
-    # create a copy of the array of medoid indices
-    Mnew = np.copy(M)
-
-    # initialize a dictionary to represent clusters
-    C = {}
-    for t in xrange(tmax):
-        # determine clusters, i. e. arrays of data indices
-        J = np.argmin(D[:,M], axis=1)
-        for kappa in range(k):
-            C[kappa] = np.where(J==kappa)[0]
-        # update cluster medoids
-        for kappa in range(k):
-            J = np.mean(D[np.ix_(C[kappa],C[kappa])],axis=1)
-            j = np.argmin(J)
-            Mnew[kappa] = C[kappa][j]
-        np.sort(Mnew)
-        # check for convergence
-        if np.array_equal(M, Mnew):
+from distancematrix import condensed_rows
+
+BLOCK_SIZE = 2 ** 20 # maximum number of distances read at once from a condensed matrix
+
+def pam(condensed_matrix, size, k, max_iter=100, seed=0):
+    ''' Cluster the elements of a condensed distance matrix around k medoids, with the initialization and the swaps
+    of FastPAM1 (Schubert and Rousseeuw, 2019), returning the medoids and the cluster of each element '''
+    k = min(k, size)
+    if k == 0:
+        return np.array([], dtype=np.int64), np.zeros(size, dtype=np.int64)
+
+    medoids = build(condensed_matrix, size, k, seed)
+    medoids = swap(condensed_matrix, size, medoids, max_iter, seed)
+    labels = condensed_rows(condensed_matrix, medoids, size).argmin(axis=0)
+    labels[medoids] = np.arange(k) # repeated elements go to their own medoid
+
+    return medoids, labels
+
+def clara(size, k, sample_distance_function, medoid_distance_function, samples=5, sample_size=None, max_iter=100, seed=0):
+    ''' Cluster a large set of elements around k medoids with CLARA (Kaufman and Rousseeuw, 1990), which runs PAM on
+    random samples and keeps the medoids with the lowest total distance over all the elements. The function
+    sample_distance_function(indexes) returns the condensed matrix of a sample and medoid_distance_function(medoids)
+    the distances from each medoid to all the elements '''
+    k = min(k, size)
+    sample_size = min(size, max(k, sample_size or 40 + 2 * k))
+    random_state = np.random.RandomState(seed)
+    best_cost, best_medoids, best_labels = np.inf, None, None
+
+    for _ in xrange(samples if sample_size < size else 1):
+        if best_medoids is None:
+            indexes = np.sort(random_state.choice(size, sample_size, replace=False))
+        else: # the best medoids so far are always part of the next samples
+            others = np.setdiff1d(np.arange(size), best_medoids)
+            indexes = np.sort(np.concatenate([best_medoids, random_state.choice(others, sample_size - k, replace=False)]))
+        sample_medoids, _ = pam(sample_distance_function(indexes), sample_size, k, max_iter, seed)
+        medoids = indexes[sample_medoids]
+        medoid_distances = medoid_distance_function(medoids)
+        cost = medoid_distances.min(axis=0).sum()
+        if cost < best_cost:
+            best_cost, best_medoids = cost, medoids
+            best_labels = medoid_distances.argmin(axis=0)
+            best_labels[medoids] = np.arange(k)
+
+    return best_medoids, best_labels
+
+def build(condensed_matrix, size, k, seed=0):
+    ''' Choose the initial medoids greedily, each one reducing the total distance to the nearest medoid as much as
+    possible, but evaluating only a random sample of 10 + sqrt(size) candidates on themselves (LAB, as in FastPAM) '''
+    sample_size = 10 + int(np.ceil(np.sqrt(size)))
+    nearest = np.full(size, np.inf)
+    is_medoid = np.zeros(size, dtype=bool)
+    medoids = []
+    random_state = np.random.RandomState(seed)
+
+    for _ in xrange(k):
+        candidates = np.flatnonzero(~is_medoid)
+        if len(candidates) > sample_size:
+            candidates = np.sort(random_state.choice(candidates, sample_size, replace=False))
+        distances = condensed_rows(condensed_matrix, candidates, size, candidates)
+        costs = np.minimum(distances, nearest[candidates]).sum(axis=1)
+        medoid = candidates[costs.argmin()]
+        medoids.append(medoid)
+        is_medoid[medoid] = True
+        nearest = np.minimum(nearest, condensed_rows(condensed_matrix, [medoid], size)[0])
+
+    return np.array(medoids, dtype=np.int64)
+
+def swap(condensed_matrix, size, medoids, max_iter=100, seed=0):
+    ''' Improve the medoids swapping them with other elements. The change of the total distance is computed for all
+    the medoids at once from the nearest and second nearest medoids of each element (FastPAM1), and a swap is done as
+    soon as it improves the clustering (as in FasterPAM) '''
+    medoids = medoids.copy()
+    k = len(medoids)
+    medoid_distances = condensed_rows(condensed_matrix, medoids, size).T.copy() # element x medoid
+    is_medoid = np.zeros(size, dtype=bool)
+    is_medoid[medoids] = True
+    blocks = row_blocks(size)
+    random_state = np.random.RandomState(seed)
+
+    for _ in xrange(max_iter):
+        swapped = False
+        nearest, second, labels, second_labels = nearest_medoids(medoid_distances)
+        removal_loss = np.bincount(labels, second - nearest, minlength=k)
+
+        for block in random_state.permutation(len(blocks)):
+            start, end = blocks[block]
+            candidate_distances = condensed_rows(condensed_matrix, np.arange(start, end), size)
+            for candidate, distances in zip(xrange(start, end), candidate_distances):
+                if is_medoid[candidate]:
+                    continue
+                closer = distances < nearest # elements that would move to the candidate whatever medoid is removed
+                between = ~closer & (distances < second) # elements that would move to the candidate if their medoid is removed
+                deltas = removal_loss + (distances[closer] - nearest[closer]).sum()
+                deltas += np.bincount(labels[closer], nearest[closer] - second[closer], minlength=k)
+                deltas += np.bincount(labels[between], distances[between] - second[between], minlength=k)
+                i = deltas.argmin()
+                if deltas[i] < -1e-10:
+                    is_medoid[medoids[i]] = False
+                    is_medoid[candidate] = True
+                    medoids[i] = candidate
+                    medoid_distances[:, i] = distances
+                    update_nearest_medoids(medoid_distances, i, nearest, second, labels, second_labels)
+                    removal_loss = np.bincount(labels, second - nearest, minlength=k)
+                    swapped = True
+        if not swapped:
             break
-        M = np.copy(Mnew)
-    else:
-        # final update of cluster memberships
-        J = np.argmin(D[:,M], axis=1)
-        for kappa in range(k):
-            C[kappa] = np.where(J==kappa)[0]
-
-    # return results
-    return M, C
\ No newline at end of file
+
+    return medoids
+
+def nearest_medoids(medoid_distances):
+    ''' Get the distance to the nearest and second nearest medoid of each element, and which medoids they are '''
+    size, k = medoid_distances.shape
+    if k == 1: # with a single medoid, any distance above the others works as the second one
+        return medoid_distances[:, 0].copy(), np.full(size, medoid_distances.max() + 1.0), np.zeros(size, dtype=np.int64), np.zeros(size, dtype=np.int64)
+
+    order = np.argpartition(medoid_distances, 1, axis=1)[:, :2]
+    labels, second_labels = order[:, 0], order[:, 1]
+    rows = np.arange(size)
+
+    return medoid_distances[rows, labels], medoid_distances[rows, second_labels], labels, second_labels
+
+def update_nearest_medoids(medoid_distances, medoid, nearest, second, labels, second_labels):
+    ''' Update the nearest and second nearest medoids after the medoid in a column changed '''
+    distances = medoid_distances[:, medoid]
+    changed = (labels == medoid) | (second_labels == medoid)
+    if medoid_distances.shape[1] == 1:
+        nearest[:] = distances
+        second[:] = distances.max() + 1.0
+        return
+
+    # elements whose nearest or second nearest medoid was replaced are computed again
+    if changed.any():
+        rows = np.flatnonzero(changed)
+        values = nearest_medoids(medoid_distances[rows])
+        for array, value in zip((nearest, second, labels, second_labels), values):
+            array[rows] = value
+
+    # the others only move if the new medoid is closer
+    first = ~changed & (distances < nearest)
+    middle = ~changed & ~first & (distances < second)
+    second[first], second_labels[first] = nearest[first], labels[first]
+    nearest[first], labels[first] = distances[first], medoid
+    second[middle], second_labels[middle] = distances[middle], medoid
+
+def row_blocks(size):
+    ''' Split the rows of a matrix in blocks that can be read at once '''
+    block_rows = max(1, BLOCK_SIZE / max(1, size))
+
+    return [(x, min(size, x + block_rows)) for x in xrange(0, size, block_rows)]
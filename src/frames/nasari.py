@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*
+
+import os
+import logging
+import numpy as np
+
+logging.basicConfig(level=logging.DEBUG, format='%(asctime)s %(levelname)s %(message)s')
+BATCH_SIZE = 100000 # vectors normalized and written at once, and maximum pairs compared at once
+
+class Nasari_Vectors:
+    '''
+    Class that implements the NASARI embeddings of BabelNet synsets as a memory-mapped matrix of L2-normalized
+    vectors, so that the cosine similarity of many pairs is computed in process with NumPy. The BabelNet ids are
+    kept sorted, with the row of each one, and found with a binary search.
+    '''
+
+    def __init__(self, vectors, ids, rows):
+        self.vectors = vectors # row -> normalized vector
+        self.ids = ids # sorted BabelNet ids, e.g. 'bn:00046516n'
+        self.rows = rows # row of each sorted id
+
+    def get_rows(self, ids):
+        ''' Get the rows of a list of BabelNet ids, -1 for the ids without a vector '''
+        ids = np.asarray(ids, dtype=np.string_)
+        rows = np.full(len(ids), -1, dtype=np.int64)
+        if len(ids) == 0 or len(self.ids) == 0:
+            return rows
+
+        positions = np.minimum(np.searchsorted(self.ids, ids), len(self.ids) - 1)
+        found = self.ids[positions] == ids
+        rows[found] = self.rows[positions[found]]
+
+        return rows
+
+    def cosine_similarity(self, ids1, ids2):
+        ''' Compute the cosine similarity of each pair (ids1[i], ids2[i]), with 1.0 for equal ids and 0.0 when an id
+        has no vector '''
+        rows1 = self.get_rows(ids1)
+        rows2 = self.get_rows(ids2)
+        similarities = np.zeros(len(rows1))
+        found = np.flatnonzero((rows1 >= 0) & (rows2 >= 0))
+
+        for start in xrange(0, len(found), BATCH_SIZE):
+            pairs = found[start:start + BATCH_SIZE]
+            similarities[pairs] = np.einsum('ij,ij->i', self.vectors[rows1[pairs]], self.vectors[rows2[pairs]])
+        similarities[np.asarray(ids1, dtype=np.string_) == np.asarray(ids2, dtype=np.string_)] = 1.0
+
+        return similarities
+
+def load_nasari(matrix_path, vectors_path):
+    ''' Map the NASARI matrix, building it if it does not exist or is older than the vector file '''
+    paths = get_matrix_paths(matrix_path)
+    if not all(os.path.exists(x) for x in paths) or os.path.getmtime(paths[-1]) < os.path.getmtime(vectors_path):
+        build_nasari(matrix_path, vectors_path)
+    vectors, rows, ids = [np.load(x, mmap_mode='r') for x in paths]
+
+    return Nasari_Vectors(vectors, ids, rows)
+
+def build_nasari(matrix_path, vectors_path):
+    ''' Convert a NASARI vector file in text format, e.g. 'bn:00046516n__Dog 0.0123 ...', with an optional word2vec
+    header, to a matrix of normalized float32 vectors. The file is read twice, so that the matrix is written
+    without keeping it in memory '''
+    logging.info('building the NASARI matrix from "%s"' % vectors_path)
+    vectors_file, rows_file, ids_file = get_matrix_paths(matrix_path)
+    ids = []
+    dimension = 0
+
+    for key, line in iter_vector_lines(vectors_path):
+        ids.append(key)
+        dimension = dimension or len(line.split()) - 1
+
+    vectors = np.lib.format.open_memmap(vectors_file, mode='w+', dtype=np.float32, shape=(len(ids), dimension))
+    batch = []
+    row = 0
+    for _, line in iter_vector_lines(vectors_path):
+        batch.append(np.array(line.split()[1:], dtype=np.float32))
+        if len(batch) == BATCH_SIZE:
+            row = write_normalized(vectors, row, batch)
+            batch = []
+    write_normalized(vectors, row, batch)
+    vectors.flush()
+    del vectors
+
+    # the first vector of repeated ids is kept, and the ids are saved the last to mark the matrix as complete
+    sorted_ids, rows = np.unique(np.array(ids, dtype=np.string_), return_index=True)
+    np.save(rows_file, rows.astype(np.int64))
+    np.save(ids_file, sorted_ids)
+
+def iter_vector_lines(vectors_path):
+    ''' Yield the BabelNet id and the line of each vector in a NASARI vector file '''
+    with open(vectors_path) as fin:
+        for i, line in enumerate(fin):
+            key = line.split(None, 1)[0] if line.strip() else None
+            if key is None or (i == 0 and len(line.split()) == 2): # empty lines and the word2vec header
+                continue
+            yield key.split('__')[0], line
+
+def write_normalized(vectors, row, batch):
+    ''' Write a batch of vectors normalized from a row, returning the next row '''
+    if batch:
+        batch = np.vstack(batch)
+        norms = np.linalg.norm(batch, axis=1)
+        vectors[row:row + len(batch)] = batch / np.where(norms > 0, norms, 1)[:, np.newaxis]
+
+    return row + len(batch)
+
+def get_matrix_paths(matrix_path):
+    ''' Get the files of the vectors, the rows of the sorted ids and the sorted ids of a NASARI matrix '''
+    return [matrix_path + x for x in ['.vectors.npy', '.rows.npy', '.ids.npy']]
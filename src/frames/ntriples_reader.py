@@ -1,67 +1,276 @@
 # -*- coding: utf-8 -*
 
-import re
+import io
 import os
+import gzip
 import json
-import codecs
-from os.path import join
-from frameinstance import FrameElement, FrameInstance
+import heapq
+import itertools
+import shutil
+import logging
+import tempfile
+import numpy as np
+from framestore import Frame_Store
+from framecache import get_snapshot_path, get_file_stats, load_snapshot, save_snapshot
+from workerpool import get_pool, get_processes, close_pool
 
-def read_folder_frames(all_instances_path, repeated_instances_path=None, delete_repetition=True):
-    ''' Read frame instances from a folder '''
-    frame_instances = {}
-    index_instances = {}
+INSTANCE_PREFIX = '<http://framebase.org/ns/fi-'
+FRAME_PREFIX = '<http://framebase.org/ns/frame-'
+ELEMENT_PREFIX = '<http://framebase.org/ns/fe-'
+TYPE_PREDICATE = '<http://www.w3.org/1999/02/22-rdf-syntax-ns#type>'
+SPILL_LINES = 1000000 # triples sorted in memory before they are spilled to a temporary file
 
-    for dir_path, dir_names, file_names in os.walk(all_instances_path):
-        for file_name in [f for f in file_names if f.endswith('.nt')]:
-            file_path = os.path.join(dir_path, file_name)
-            read_file_frames(file_path, frame_instances, index_instances, delete_repetition)
+def read_folder_frames(all_instances_path, repeated_instances_path=None, delete_repetition=True, use_snapshot=True):
+    ''' Read frame instances from a folder, re-parsing only the files that changed since its last snapshot. The path
+    can also be a single dump (gzipped if it ends with .gz) whose triples are in any order, which is sorted
+    externally when it changes '''
+    snapshot_path = get_snapshot_path(all_instances_path)
+    snapshot = load_snapshot(snapshot_path) if use_snapshot else None
+    files = [describe_file(all_instances_path, x) for x in list_files_frames(all_instances_path)]
+
+    if snapshot and is_snapshot_current(snapshot, files):
+        logging.info('Loading frame instances from snapshot "%s"' % snapshot_path)
+        frame_store = snapshot['store']
+        index_keys = snapshot['index_keys']
+        index_groups = snapshot['index_groups']
+    else:
+        frame_store = parse_files(all_instances_path, files, snapshot)
+        index_keys, index_groups = group_indexes(frame_store.dedup_keys())
+        if use_snapshot:
+            save_snapshot(snapshot_path, frame_store, files, index_keys, index_groups)
+    frame_store.index_groups = index_groups
+
+    if delete_repetition:
+        rows = np.unique(index_groups, return_index=True)[1].tolist() # first instance of each index
+    else:
+        rows = xrange(len(frame_store))
+    frame_instances = {frame_store.instance_ids[row]:frame_store.instance(row) for row in rows}
 
     if repeated_instances_path:
+        group_instances = [[] for _ in xrange(len(index_keys))]
+        for instance_id, group in zip(frame_store.instance_ids, index_groups.tolist()):
+            group_instances[group].append(instance_id)
         with open(repeated_instances_path, 'w') as fout:
-            json.dump(index_instances, fout, indent=4, sort_keys=True)
+            json.dump({'%016x' % k:v for k, v in zip(index_keys.tolist(), group_instances)}, fout)
 
     return frame_instances
 
-def read_file_frames(file_path, frame_instances, index_instances, delete_repetition):
-    ''' Read frame instances from a file '''
-    previous_instance_id = None
+def list_files_frames(all_instances_path):
+    ''' List the N-Triples files of a folder (gzipped or not) in a stable order, or the path if it is a file '''
+    if os.path.isfile(all_instances_path):
+        return [all_instances_path]
+    file_paths = []
+
+    for dir_path, dir_names, file_names in os.walk(all_instances_path):
+        dir_names.sort()
+        for file_name in sorted(f for f in file_names if f.endswith(('.nt', '.nt.gz'))):
+            file_paths.append(os.path.join(dir_path, file_name))
+
+    return file_paths
+
+def describe_file(all_instances_path, file_path):
+    ''' Describe a file by its path relative to the folder (or its name if the path is a dump), size and mtime '''
+    size, mtime = get_file_stats(file_path)
+
+    return {'path':os.path.relpath(file_path, get_folder(all_instances_path)), 'size':size, 'mtime':mtime}
+
+def get_folder(all_instances_path):
+    ''' Get the folder of the files of frame instances, the parent folder if the path is a dump '''
+    return os.path.dirname(all_instances_path) if os.path.isfile(all_instances_path) else all_instances_path
+
+def is_file_current(file_info, snapshot):
+    ''' Check if a file has the same size and mtime than when the snapshot was built '''
+    previous = snapshot['files'].get(file_info['path']) if snapshot else None
+
+    return previous is not None and previous['size'] == file_info['size'] and previous['mtime'] == file_info['mtime']
+
+def is_snapshot_current(snapshot, files):
+    ''' Check if a snapshot contains exactly the current files, in the same order '''
+    if len(snapshot['files']) != len(files):
+        return False
+
+    expected_start = 0
+    for file_info in files:
+        if not is_file_current(file_info, snapshot) or snapshot['files'][file_info['path']]['start'] != expected_start:
+            return False
+        expected_start = snapshot['files'][file_info['path']]['end']
+
+    return True
+
+def parse_files(all_instances_path, files, snapshot, chunks_per_process=4):
+    ''' Build a store with the rows of the unchanged files copied from the snapshot and the other files parsed. With
+    the worker pool each file is parsed in a worker into its own compact store, whose strings are mapped to the
+    store when it is appended; otherwise the files are parsed into the store directly '''
+    frame_store = Frame_Store(snapshot['store'].strings if snapshot else None)
+    changed_paths = [os.path.join(all_instances_path, x['path']) for x in files if not is_file_current(x, snapshot)]
+    logging.info('Parsing %d of %d frame files' % (len(changed_paths), len(files)))
+    pool = get_pool() if len(changed_paths) > 1 else None
+    if pool is not None:
+        chunk_size = max(1, len(changed_paths) / (get_processes() * chunks_per_process))
+        parsed_files = pool.imap(parse_file_frames, changed_paths, chunk_size)
+
+    if snapshot:
+        snapshot_store = snapshot['store']
+        snapshot_mapping = np.arange(len(snapshot_store.strings), dtype=np.int32) # the new store starts with the same strings
+
+    for file_info in files:
+        start = len(frame_store)
+        if is_file_current(file_info, snapshot):
+            previous = snapshot['files'][file_info['path']]
+            frame_store.extend(snapshot_store, previous['start'], previous['end'], snapshot_mapping)
+        elif os.path.isfile(all_instances_path):
+            for instance_id, frame_type, elements in iter_unsorted_records(all_instances_path):
+                frame_store.add_instance(instance_id, frame_type, elements)
+        elif pool is not None:
+            frame_store.extend(next(parsed_files))
+        else:
+            for _ in iter_file_frames(os.path.join(all_instances_path, file_info['path']), frame_store):
+                pass
+        file_info['start'], file_info['end'] = start, len(frame_store)
+    frame_store.compact()
+    if pool is not None:
+        close_pool() # the next stage forks the workers again, so that they get the new store
+
+    return frame_store
 
-    with codecs.open(file_path, 'r', 'utf-8') as fin:
+def parse_file_frames(file_path):
+    ''' Parse a file into its own compact store, e.g. in a worker '''
+    file_store = Frame_Store()
+    for _ in iter_file_frames(file_path, file_store):
+        pass
+    file_store.compact()
+
+    return file_store
+
+def group_indexes(row_keys):
+    ''' Group rows with the same deduplication key, returning the distinct keys and the group of each row '''
+    index_keys, index_groups = np.unique(row_keys, return_inverse=True)
+
+    return index_keys, index_groups.astype(np.int32)
+
+def iter_file_frames(file_path, frame_store):
+    ''' Yield the frame instances of a file, whose triples must be contiguous and start with rdf:type '''
+    for fi in iter_lines_frames(iter_file_lines(file_path), frame_store):
+        yield fi
+
+def iter_file_lines(file_path):
+    ''' Yield the lines of an N-Triples file as unicode, decompressing it if it ends with .gz '''
+    if not file_path.endswith('.gz'):
+        with io.open(file_path, 'r', encoding='utf-8') as fin:
+            for line in fin:
+                yield line
+        return
+
+    with gzip.open(file_path, 'rb') as fin:
         for line in fin:
-            tuple_elements = line.split(' ')
-            instance_id = re.match('<http://framebase.org/ns/fi-(.+)>', tuple_elements[0]).group(1)
-
-            if instance_id != previous_instance_id:
-                fi = FrameInstance(instance_id)
-                fi.frame_type = re.match('<http://framebase.org/ns/frame-(.+)>', tuple_elements[2]).group(1)
-                frame_instances[instance_id] = fi
-                if previous_instance_id:
-                    check_repetition(previous_instance_id, frame_instances, index_instances, delete_repetition)       
-                previous_instance_id = instance_id
-            else:
-                fe = FrameElement()
-                fe.role = re.match('<http://framebase.org/ns/fe-(.+)>', tuple_elements[1]).group(1)
-                fe.entity = tuple_elements[2]
-                frame_instances[instance_id].frame_elements.append((fe))
-
-    if previous_instance_id:
-        check_repetition(instance_id, frame_instances, index_instances, delete_repetition)
-
-def check_repetition(instance_id, frame_instances, index_instances, delete_repetition):
-    ''' Check if exist two frames with the same index '''
-    index = create_index(frame_instances[instance_id])
-    if index in index_instances:
-        index_instances[index].append(instance_id)
-        if delete_repetition:
-            del frame_instances[instance_id]
-    else:
-        index_instances[index] = [instance_id]
+            yield line.decode('utf-8')
+
+def iter_folder_records(all_instances_path):
+    ''' Yield the (instance id, frame type, [(role, entity URI)]) records of all the files of a folder, reading them
+    as a stream without keeping the instances in memory. The path can also be a single dump in any order '''
+    if os.path.isfile(all_instances_path):
+        for record in iter_unsorted_records(all_instances_path):
+            yield record
+        return
+
+    for file_path in list_files_frames(all_instances_path):
+        for record in iter_lines_records(iter_file_lines(file_path)):
+            yield record
+
+def iter_folder_elements(all_instances_path):
+    ''' Yield the (role, entity URI) of the frame element triples of a folder or a dump, without grouping them by
+    instance, so that a dump is not sorted, e.g. to collect the entities before reading the instances '''
+    element_start = len(ELEMENT_PREFIX)
+    for file_path in list_files_frames(all_instances_path):
+        for _, rank, _, line in iter_instance_triples(file_path):
+            if rank == 1:
+                _, predicate, value = line.split(' ', 3)[:3]
+                yield predicate[element_start:-1], value
+
+def iter_lines_frames(lines, frame_store):
+    ''' Yield the frame instances of an iterable of N-Triples lines, adding them to a store '''
+    for instance_id, frame_type, elements in iter_lines_records(lines):
+        yield frame_store.instance(frame_store.add_instance(instance_id, frame_type, elements))
+
+def iter_lines_records(lines):
+    ''' Yield the (instance id, frame type, [(role, entity URI)]) records of an iterable of N-Triples lines '''
+    instance_start = len(INSTANCE_PREFIX)
+    frame_start = len(FRAME_PREFIX)
+    element_start = len(ELEMENT_PREFIX)
+    instance_id = None
+    frame_type = None
+    elements = []
+
+    for line in lines:
+        subject, predicate, value = line.split(' ', 3)[:3]
+        current_id = subject[instance_start:-1]
+
+        if current_id != instance_id:
+            if instance_id is not None:
+                yield instance_id, frame_type, elements
+            instance_id = current_id
+            frame_type = value[frame_start:-1]
+            elements = []
+        else:
+            elements.append((predicate[element_start:-1], value))
+
+    if instance_id is not None:
+        yield instance_id, frame_type, elements
+
+def iter_unsorted_records(file_path, spill_lines=SPILL_LINES, temporary_path=None):
+    ''' Yield the (instance id, frame type, [(role, entity URI)]) records of a file whose triples can be in any order '''
+    return iter_lines_records(iter_sorted_lines(file_path, spill_lines, temporary_path))
+
+def iter_sorted_lines(file_path, spill_lines=SPILL_LINES, temporary_path=None):
+    ''' Yield the triples of frame instances of an N-Triples file (gzipped if it ends with .gz) grouped by instance,
+    with rdf:type first and the frame elements in their original order. The file is sorted externally: chunks of
+    spill_lines triples are sorted in memory and written to temporary files, which are merged at the end. The
+    instances without a frame type are skipped '''
+    spill_folder = tempfile.mkdtemp(prefix='frames_sort_', dir=temporary_path)
+    try:
+        spill_paths = []
+        lines = iter_instance_triples(file_path)
+        for chunk in iter(lambda: sorted(itertools.islice(lines, spill_lines)), []):
+            spill_paths.append(os.path.join(spill_folder, '%d.tsv' % len(spill_paths)))
+            with io.open(spill_paths[-1], 'w', encoding='utf-8') as fout:
+                fout.writelines(u'%s\t%d\t%d\t%s' % x for x in chunk)
+        logging.info('Merging %d sorted chunks of "%s"' % (len(spill_paths), file_path))
+
+        spill_files = [io.open(x, 'r', encoding='utf-8') for x in spill_paths]
+        try:
+            instance_id = None
+            for subject, rank, _, line in heapq.merge(*[iter_spill_file(x) for x in spill_files]):
+                if subject != instance_id:
+                    instance_id = subject
+                    has_type = rank == 0
+                    if has_type:
+                        yield line
+                elif has_type and rank == 1: # only the first frame type of an instance
+                    yield line
+        finally:
+            for spill_file in spill_files:
+                spill_file.close()
+    finally:
+        shutil.rmtree(spill_folder)
+
+def iter_instance_triples(file_path):
+    ''' Yield the (subject, rank, position, line) of the triples of frame instances of a file, where rank is 0 for
+    their frame type and 1 for their frame elements, and position is the line number '''
+    for position, line in enumerate(iter_file_lines(file_path)):
+        parts = line.split(' ', 3)
+        if len(parts) < 3 or not parts[0].startswith(INSTANCE_PREFIX):
+            continue
+        if parts[1] == TYPE_PREDICATE and parts[2].startswith(FRAME_PREFIX):
+            yield parts[0], 0, position, line.rstrip() + u'\n'
+        elif parts[1].startswith(ELEMENT_PREFIX):
+            yield parts[0], 1, position, line.rstrip() + u'\n'
 
-def create_index(frame_instance):
-    ''' Create an index for a frame using its frame type and frame elements '''
-    frame_type = frame_instance.frame_type
-    frame_elements = sorted([x.entity.split('/')[-1][:-1] for x in frame_instance.frame_elements])
-    frame_index = frame_type + '#' + '#'.join(frame_elements)
+def iter_spill_file(spill_file):
+    ''' Yield the (subject, rank, position, line) of the triples of a spill file '''
+    for line in spill_file:
+        subject, rank, position, triple = line.split('\t', 3)
+        yield subject, int(rank), int(position), triple
 
-    return frame_index
\ No newline at end of file
+def get_element_names(elements, lowercase=False):
+    ''' Get the (role, entity name) pairs of the (role, entity URI) elements of a record, as Frame_Store.element_names '''
+    return [(x.lower() if lowercase else x, y[y.rfind('/') + 1:-1]) for x, y in elements]
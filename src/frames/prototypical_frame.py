@@ -1,33 +1,72 @@
 # -*- coding: utf-8 -*
 
+import os
 import logging
 import kmedoids
+import distancematrix
 import numpy as np
-from multiprocessing import Pool
+from framestore import dedup_key, hash_string, mix64, expand_ranges
+from heavyhitters import Space_Saving
+from scheduler import map_frame_types
+from workerpool import add_worker_setup
 from frameinstancesimilarity import Frame_Similarity
-from ntriples_reader import create_index
+from distancecache import get_matrix_path, load_distance_matrix, save_distance_matrix
 from scipy.cluster.hierarchy import linkage, fcluster
-from scipy.spatial.distance import squareform
+from scipy.sparse import coo_matrix, csr_matrix
+from scipy.sparse.csgraph import connected_components
 
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s %(levelname)s %(message)s')
+DISTANCES_PATH = '../../resource/frames/distances'
+SIMILARITY_SETTINGS = {'alpha':0, 'roles':False, 'ftsim':'occ', 'fesim':'wup'}
+MINHASH_BANDS = 8 # bands of the LSH index of the frame instances
+MINHASH_ROWS = 2 # MinHash values in each band
+MAX_NEIGHBORS = 10 # candidates of each instance in an LSH bucket, so that the buckets of common entities stay linear
+MAX_WORKER_INSTANCES = 2000 # larger frame types compute their distance matrix with the whole pool instead of one worker
 sim_evaluator = Frame_Similarity()
 
-def find_prototypical_instances(frame_instances, min_elements=10):
-    ''' Find prototypical frame instances for each frame type '''
+def find_prototypical_instances(frame_instances, min_elements=10, approach=None):
+    ''' Find prototypical frame instances for each frame type, analysing the frame types in parallel in the worker
+    pool, where the approach runs on its own. With the approaches that compute a distance matrix, the frame types
+    with more than MAX_WORKER_INSTANCES instances run afterwards in this process, one at a time, so that the row
+    blocks of their matrix are computed by the whole pool instead of leaving one worker with most of the work '''
+    approach = approach or frequency_approach
+    max_instances = MAX_WORKER_INSTANCES if approach in (hierarchical_approach, partitional_approach) else None
+    type_data = {x:(approach, y) for x, y in frame_instances.items() if len(y) >= min_elements}
+    large_types = sorted((x for x, (_, y) in type_data.items() if max_instances and len(y) > max_instances),
+                         key=lambda x: (-len(type_data[x][1]), x))
+    large_data = {x:type_data.pop(x) for x in large_types}
+    type_sizes = {x:len(y) for x, (_, y) in type_data.items()}
     prototypical_instances = {}
-    for frame_type in frame_instances.keys():
-        if len(frame_instances[frame_type]) >= min_elements:
-            logging.info('Analysing prototypical frames for %s' % frame_type)
-            instance = frequency_approach(frame_instances[frame_type])
-            prototypical_instances.update(instance)
+
+    for frame_type, instances in map_frame_types(find_type_instances, type_data, type_sizes):
+        prototypical_instances.update(instances)
+    for frame_type in large_types:
+        logging.info('Frame type %s (%d instances) runs with the whole pool' % (frame_type, len(large_data[frame_type][1])))
+        prototypical_instances.update(find_type_instances(frame_type, large_data[frame_type]))
 
     return prototypical_instances
 
-def partitional_approach(frame_instances, percentage=10):
-    ''' Find prototypical frame instances using partitional clustering approach '''
-    condensed_matrix, instance_indexes = create_distance_matrix(frame_instances)
+def find_type_instances(frame_type, data):
+    ''' Find the prototypical frame instances of a frame type with an approach '''
+    approach, frame_instances = data
+
+    return approach(frame_instances)
+
+def partitional_approach(frame_instances, percentage=10, max_pam_instances=5000):
+    ''' Find prototypical frame instances using partitional clustering approach, sampling with CLARA the frame types
+    with more than max_pam_instances instances instead of computing all their distances '''
     num_clusters = len(frame_instances)/percentage + 1
-    medoids, clusters = kmedoids.kMedoids(squareform(condensed_matrix), num_clusters)
+
+    if len(frame_instances) <= max_pam_instances:
+        condensed_matrix, instance_indexes = create_distance_matrix(frame_instances)
+        medoids, clusters = kmedoids.pam(condensed_matrix, len(instance_indexes), num_clusters)
+    else:
+        add_worker_setup(load_similarity_resources)
+        instance_indexes = sorted(frame_instances.keys())
+        frames = [frame_instances[x] for x in instance_indexes]
+        sample_distances = lambda indexes: distancematrix.create_distance_matrix([frames[i] for i in indexes], calculate_distances)
+        medoid_distances = lambda medoids: distancematrix.create_distance_rows([frames[i] for i in medoids], frames, calculate_distances)
+        medoids, clusters = kmedoids.clara(len(frames), num_clusters, sample_distances, medoid_distances)
     medoid_instances = {}
 
     for point_index in medoids:
@@ -40,15 +79,22 @@ def hierarchical_approach(frame_instances, threshold=0.3):
     ''' Find prototypical frame instances using hierarchical clustering approach '''
     condensed_matrix, instance_indexes = create_distance_matrix(frame_instances)
     assignments = fcluster(linkage(condensed_matrix, method='average'), threshold)
-    clusters = {}
+    medoids = find_medoids(assignments, instance_indexes, condensed_matrix)
+    medoid_instances = {}
 
-    for i in xrange(len(assignments)):
-        id_cluster = assignments[i]
-        element_cluster = instance_indexes[i]
-        if id_cluster not in clusters: clusters[id_cluster] = []
-        clusters[id_cluster].append(element_cluster)
+    for frame_id in medoids:
+        medoid_instances[frame_id] = format_instance(frame_instances[frame_id])
+
+    return medoid_instances
 
-    medoids = find_medoids(clusters, instance_indexes, squareform(condensed_matrix))
+def graph_approach(frame_instances, threshold=0.3, min_elements=3):
+    ''' Find prototypical frame instances clustering the sparse distance graph of the candidate pairs, where the
+    clusters are the connected components of the pairs closer than threshold '''
+    graph, instance_indexes = create_distance_graph(frame_instances)
+    close = graph.data <= threshold
+    edges = csr_matrix((np.ones(close.sum()), (graph.row[close], graph.col[close])), shape=graph.shape)
+    _, assignments = connected_components(edges, directed=False)
+    medoids = find_graph_medoids(assignments, instance_indexes, graph, min_elements)
     medoid_instances = {}
 
     for frame_id in medoids:
@@ -57,82 +103,198 @@ def hierarchical_approach(frame_instances, threshold=0.3):
     return medoid_instances
 
 def frequency_approach(frame_instances, top=10):
-    ''' Find prototypical frame instances using the frequency approach '''
-    frequency_instances = {}
+    ''' Find prototypical frame instances using the frequency approach, i.e. the first instance of the most repeated
+    groups of the deduplication index '''
+    frames = sorted(frame_instances.values(), key=lambda x: x.row)
+    groups = np.array([x.index_group for x in frames], dtype=np.int64)
+    _, first_rows, counts = np.unique(groups, return_index=True, return_counts=True)
     frequent_instances = {}
 
-    for frame_id in frame_instances.keys():
-        index = create_index(frame_instances[frame_id])
-        if index not in frequency_instances:
-            frequency_instances[index] = []
-        frequency_instances[index].append(frame_id)
+    for i in np.lexsort((first_rows, -counts))[:top]:
+        frame_instance = frames[first_rows[i]]
+        frequent_instances[frame_instance.id] = format_instance(frame_instance)
 
-    for index, frame_ids in sorted(frequency_instances.items(), key=lambda x:len(x[1]), reverse=True)[:top]:
-        frame_id = frame_ids[0]
-        frequent_instances[frame_id] = format_instance(frame_instances[frame_id])
+    return frequent_instances
+
+def streaming_frequency_approach(records, top=10, capacity=1000, min_elements=10):
+    ''' Find prototypical frame instances of each frame type with the frequency approach over a stream of
+    (instance id, frame type, [(role, entity name)]) records, e.g. a whole FrameBase dump, counting the repeated
+    instances of each frame type with capacity Space-Saving counters instead of keeping all the instances '''
+    summaries = {}
+    for instance_id, frame_type, element_names in records:
+        if frame_type not in summaries:
+            summaries[frame_type] = Space_Saving(capacity)
+        key = dedup_key(frame_type, [e for r, e in element_names])
+        summaries[frame_type].add(key, (instance_id, element_names))
+    frequent_instances = {}
+
+    for frame_type, summary in summaries.items():
+        if summary.total >= min_elements:
+            for _, _, _, (instance_id, element_names) in summary.top(top):
+                frequent_instances[instance_id] = {'type':frame_type, 'elements':dict(element_names)}
 
     return frequent_instances
 
-def create_distance_matrix(frame_instances):
-    ''' Create the distance matrix in condensed format '''
-    frame_keys = frame_instances.keys()
-    size = len(frame_keys)
-    instance_indexes = []
-    tuple_list = []
-
-    for i in xrange(size):
-        frame1 = frame_instances[frame_keys[i]]
-        instance_indexes.append(frame_keys[i])
-        for j in xrange(i+1, size):
-            frame2 = frame_instances[frame_keys[j]]
-            tuple_list.append((frame1, frame2))
-
-    pool = Pool(processes=4)
-    condensed_matrix = pool.map(calculate_distance, tuple_list)
-
-    return np.array(condensed_matrix), instance_indexes
-
-def calculate_distance(frames):
-    distance = 1 - sim_evaluator.frame_instance_similarity(frames[0], frames[1], alpha=0)
-
-    return distance
-
-def find_medoids(clusters, instance_indexes, square_matrix, min_elements=3):
-    ''' Find the medoids for a set of clusters '''
-    medoids = []
-
-    for cluster in clusters:
-        elements = clusters[cluster]
-        if len(elements) >= min_elements:
-            indexes = [instance_indexes.index(x) for x in elements]
-            medoid = instance_indexes[get_medoid_id(indexes, square_matrix)]
-            medoids.append(medoid)
-
-    return medoids
-
-def get_medoid_id(indexes, square_matrix):
-    ''' Get the medoid of a cluster '''
-    size = len(indexes)
-    min_distance = float('inf')
-    medoid_id = None
-        
-    for i in xrange(size):
-        global_distance = 0
-        for j in xrange(size):
-            if j != i:
-                distance = square_matrix[indexes[i]][indexes[j]]
-                global_distance += distance
-                if global_distance > min_distance:
-                    break
-        if global_distance < min_distance:
-            min_distance = global_distance
-            medoid_id = indexes[i]
-
-    return medoid_id
+def create_distance_matrix(frame_instances, use_cache=True):
+    ''' Create the distance matrix in condensed format, reusing the one stored for the same frame instances and
+    similarity settings '''
+    instance_indexes = sorted(frame_instances.keys())
+    frames = [frame_instances[x] for x in instance_indexes]
+    add_worker_setup(load_similarity_resources)
+    if not use_cache:
+        return distancematrix.create_distance_matrix(frames, calculate_distances), instance_indexes
+
+    resource_paths = sim_evaluator.get_resource_paths(*get_similarity_measures())
+    matrix_path = get_matrix_path(os.path.join(os.path.dirname(__file__), DISTANCES_PATH), frames[0].frame_type, instance_indexes,
+                                  SIMILARITY_SETTINGS, (x.element_names() for x in frames), resource_paths)
+    condensed_matrix = load_distance_matrix(matrix_path, len(frames))
+    if condensed_matrix is None:
+        condensed_matrix = save_distance_matrix(matrix_path, frames, calculate_distances)
+    else:
+        logging.info('Reusing the distance matrix in "%s"' % matrix_path)
+
+    return condensed_matrix, instance_indexes
+
+def create_distance_graph(frame_instances):
+    ''' Create a sparse distance graph with the distances of the candidate pairs of similar instances found with
+    MinHash and LSH, instead of all the pairs '''
+    instance_indexes = sorted(frame_instances.keys())
+    frames = [frame_instances[x] for x in instance_indexes]
+    add_worker_setup(load_similarity_resources)
+    rows, columns = candidate_pairs(minhash_signatures(frames))
+    distances = np.zeros(len(rows))
+
+    sources, starts = np.unique(rows, return_index=True)
+    ends = np.append(starts[1:], len(rows))
+    for source, start, end in zip(sources, starts, ends):
+        distances[start:end] = calculate_distances(frames[source], [frames[x] for x in columns[start:end]])
+    logging.info('Computed %d of %d distances of the candidate pairs' % (len(rows), len(frames) * (len(frames) - 1) / 2))
+
+    return coo_matrix((distances, (rows, columns)), shape=(len(frames), len(frames))), instance_indexes
+
+def minhash_signatures(frames, num_hashes=MINHASH_BANDS * MINHASH_ROWS):
+    ''' Compute the MinHash signature of the set of entities of each frame instance, as a frames x num_hashes
+    matrix, where each hash function mixes the entity keys with a different seed. Instances without elements have
+    the maximum value in all their hashes '''
+    store = frames[0].store if frames else None
+    if all(x.store is store for x in frames): # use the ids of the store instead of hashing the strings
+        positions, counts = store.element_positions([x.row for x in frames])
+        entities = np.asarray(store.entities)[positions].astype(np.uint64)
+    else:
+        names = [[e for r, e in x.element_names()] for x in frames]
+        counts = np.array([len(x) for x in names], dtype=np.int64)
+        entities = np.array([hash_string(e) for x in names for e in x], dtype=np.uint64)
+    signatures = np.full((len(frames), num_hashes), np.iinfo(np.uint64).max, dtype=np.uint64)
+    nonempty = np.flatnonzero(counts > 0)
+    if len(nonempty) == 0:
+        return signatures
+
+    starts = (np.cumsum(counts) - counts)[nonempty]
+    seeds = mix64(np.arange(1, num_hashes + 1, dtype=np.uint64))
+    for i, seed in enumerate(seeds):
+        signatures[nonempty, i] = np.minimum.reduceat(mix64(entities ^ seed), starts)
+
+    return signatures
+
+def candidate_pairs(signatures, bands=MINHASH_BANDS, rows=MINHASH_ROWS, max_neighbors=MAX_NEIGHBORS):
+    ''' Get the pairs (i, j), i < j, of instances that share the MinHash values of a band (LSH), sorted by i. Each
+    instance is only paired with the next max_neighbors instances of its bucket, which still connects all of them '''
+    size = len(signatures)
+    instances = np.flatnonzero((signatures != np.iinfo(np.uint64).max).any(axis=1))
+    pair_keys = [np.array([], dtype=np.int64)]
+
+    for band in xrange(bands):
+        band_hashes = signatures[instances, band * rows:(band + 1) * rows]
+        keys = band_hashes[:, 0]
+        for column in xrange(1, rows):
+            keys = mix64(keys) ^ band_hashes[:, column]
+        order = np.lexsort((instances, keys)) # buckets of instances in index order
+        keys, members = keys[order], instances[order]
+        for offset in xrange(1, max_neighbors + 1):
+            same = keys[offset:] == keys[:-offset]
+            if not same.any():
+                break
+            pair_keys.append(members[:-offset][same] * size + members[offset:][same])
+    pair_keys = np.unique(np.concatenate(pair_keys))
+
+    return pair_keys / size, pair_keys % size
+
+def load_similarity_resources():
+    ''' Load the resources of the similarity measures in SIMILARITY_SETTINGS '''
+    sim_evaluator.load_resources(*get_similarity_measures())
+
+def get_similarity_measures():
+    ''' Get the frame type and frame element measures in SIMILARITY_SETTINGS, without the frame type measure when
+    alpha is 0, since it does not change the distances '''
+    ftsim = SIMILARITY_SETTINGS['ftsim'] if SIMILARITY_SETTINGS['alpha'] else None
+
+    return ftsim, SIMILARITY_SETTINGS['fesim']
+
+def calculate_distances(frame, other_frames):
+    distances = 1 - sim_evaluator.frame_instance_similarity_bulk(frame, other_frames, **SIMILARITY_SETTINGS)
+
+    return distances
+
+def find_medoids(assignments, instance_indexes, condensed_matrix, min_elements=3):
+    ''' Find the medoids of the clusters with at least min_elements elements, i.e. the element with the lowest sum of
+    distances to the rest of its cluster (the first one if there is a tie), all the clusters at once '''
+    size = len(instance_indexes)
+    _, labels = np.unique(assignments, return_inverse=True)
+    counts = np.bincount(labels)
+    elements = np.flatnonzero(counts[labels] >= min_elements)
+    elements = elements[np.argsort(labels[elements], kind='mergesort')] # grouped by cluster, in index order
+    if len(elements) == 0:
+        return []
+
+    # distances from each element to all the elements of its cluster, read in blocks of pairs
+    valid_counts = np.where(counts >= min_elements, counts, 0)
+    row_starts = (np.cumsum(valid_counts) - valid_counts)[labels[elements]]
+    row_sizes = counts[labels[elements]]
+    cumulative_sizes = np.cumsum(row_sizes)
+    global_distances = np.zeros(len(elements))
+    start = 0
+    while start < len(elements):
+        end = max(start + 1, np.searchsorted(cumulative_sizes, cumulative_sizes[start] - row_sizes[start] + kmedoids.BLOCK_SIZE, side='right'))
+        sizes = row_sizes[start:end]
+        pair_rows = np.repeat(np.arange(end - start), sizes)
+        pair_columns = expand_ranges(row_starts[start:end], sizes)
+        distances = distancematrix.condensed_distances(condensed_matrix, elements[start + pair_rows], elements[pair_columns], size)
+        global_distances[start:end] = np.bincount(pair_rows, weights=distances, minlength=end - start)
+        start = end
+
+    return [instance_indexes[x] for x in lowest_per_cluster(elements, global_distances, labels[elements])]
+
+def find_graph_medoids(assignments, instance_indexes, graph, min_elements=3):
+    ''' Find the medoids of the clusters with at least min_elements elements in a sparse distance graph, i.e. the
+    element with the lowest sum of distances to the rest of its cluster (the first one if there is a tie), where the
+    pairs without a distance are counted as the maximum distance, 1.0 '''
+    size = len(instance_indexes)
+    _, labels = np.unique(assignments, return_inverse=True)
+    counts = np.bincount(labels)
+    elements = np.flatnonzero(counts[labels] >= min_elements)
+    if len(elements) == 0:
+        return []
+
+    same = labels[graph.row] == labels[graph.col]
+    pair_elements = np.concatenate([graph.row[same], graph.col[same]])
+    pair_distances = np.concatenate([graph.data[same], graph.data[same]])
+    known_distances = np.bincount(pair_elements, weights=pair_distances, minlength=size)
+    known_pairs = np.bincount(pair_elements, minlength=size)
+    global_distances = known_distances + (counts[labels] - 1 - known_pairs)
+
+    return [instance_indexes[x] for x in lowest_per_cluster(elements, global_distances[elements], labels[elements])]
+
+def lowest_per_cluster(elements, distances, element_labels):
+    ''' Get the element with the lowest sum of distances of each cluster, the first one if there is a tie '''
+    order = np.lexsort((elements, distances, element_labels))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = element_labels[order][1:] != element_labels[order][:-1]
+
+    return elements[order[first]]
 
 def format_instance(frame_instance):
     ''' Convert a frane instance to dict format '''
     frame_type = frame_instance.frame_type
-    frame_elements = {x.role.lower():x.entity.split('/')[-1][:-1] for x in frame_instance.frame_elements}
+    frame_elements = dict(frame_instance.element_names(lowercase=True))
 
     return {'type':frame_type, 'elements':frame_elements}
\ No newline at end of file
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*
+
+import time
+import logging
+from workerpool import get_pool
+
+logging.basicConfig(level=logging.DEBUG, format='%(asctime)s %(levelname)s %(message)s')
+
+def map_frame_types(function, type_data, type_sizes):
+    ''' Apply function(frame_type, data) to the data of each frame type, yielding (frame_type, result) as soon as
+    each one finishes. With the worker pool the frame types are sent the largest first, according to a dict frame
+    type -> number of instances, so that a big frame type does not start at the end of the run. The data is pickled
+    to the workers, so the frame instances should be views over a store loaded before the pool started '''
+    frame_types = sorted(type_data, key=lambda x: (-type_sizes[x], x))
+    tasks = ((function, x, type_data[x]) for x in frame_types)
+    start_time = time.time()
+    pool = get_pool()
+    results = pool.imap_unordered(run_task, tasks) if pool is not None else (run_task(x) for x in tasks)
+
+    for done, (frame_type, result, seconds) in enumerate(results, 1):
+        logging.info('Frame type %s (%d instances) took %.2fs, %d/%d frame types done in %.2fs' %
+                     (frame_type, type_sizes[frame_type], seconds, done, len(frame_types), time.time() - start_time))
+        yield frame_type, result
+
+def run_task(task):
+    ''' Apply a function to the data of a frame type, measuring its time '''
+    function, frame_type, data = task
+    start_time = time.time()
+    result = function(frame_type, data)
+
+    return frame_type, result, time.time() - start_time
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*
+
+import os
+import sqlite3
+import logging
+from collections import OrderedDict
+from multiprocessing.util import Finalize
+
+logging.basicConfig(level=logging.DEBUG, format='%(asctime)s %(levelname)s %(message)s')
+
+class Similarity_Cache:
+    '''
+    Class that implements a bounded LRU cache of similarities between pairs of items, backed by a SQLite file
+    that is shared by all the processes and kept across runs
+    '''
+
+    def __init__(self, cache_path, max_size=500000, flush_size=5000):
+        self.__cache_path = cache_path
+        self.__max_size = max_size
+        self.__flush_size = flush_size
+        self.__memory = OrderedDict()
+        self.__pending = {}
+        self.__connection = None
+        self.__pid = None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def get(self, measure, item1, item2):
+        ''' Get the similarity of a pair of items, or None if it was never computed '''
+        key = create_key(measure, item1, item2)
+        value = self.__memory.pop(key, None)
+        if value is None:
+            value = self.__pending.get(key)
+
+        if value is not None:
+            self.hits += 1
+        else:
+            row = self.get_connection().execute('SELECT value FROM similarities WHERE measure=? AND item1=? AND item2=?', key).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            value = row[0]
+            self.disk_hits += 1
+
+        self.__memory[key] = value # most recently used at the end
+        self.evict()
+
+        return value
+
+    def get_many(self, measure, pairs):
+        ''' Get the similarities of a list of (item1, item2) pairs, with None for the pairs never computed. The pairs
+        that are not in memory are read from disk in a single query '''
+        keys = [create_key(measure, x, y) for x, y in pairs]
+        values = [self.__memory.pop(x, None) for x in keys]
+        values = [self.__pending.get(x) if y is None else y for x, y in zip(keys, values)]
+        missing = [i for i, x in enumerate(values) if x is None]
+        self.hits += len(keys) - len(missing)
+
+        stored = self.read_many(set(keys[i] for i in missing)) if missing else {}
+        for i in missing:
+            values[i] = stored.get(keys[i])
+        self.disk_hits += sum(1 for i in missing if values[i] is not None)
+        self.misses += sum(1 for i in missing if values[i] is None)
+
+        for key, value in zip(keys, values):
+            if value is not None:
+                self.__memory[key] = value # most recently used at the end
+        self.evict()
+
+        return values
+
+    def read_many(self, keys):
+        ''' Read the similarities of some keys from disk, joining them in a temporary table '''
+        connection = self.get_connection()
+        with connection:
+            connection.execute('CREATE TEMP TABLE IF NOT EXISTS lookup (measure TEXT, item1 TEXT, item2 TEXT)')
+            connection.execute('DELETE FROM lookup')
+            connection.executemany('INSERT INTO lookup VALUES (?, ?, ?)', keys)
+            rows = connection.execute('SELECT s.measure, s.item1, s.item2, s.value FROM lookup l JOIN similarities s ON s.measure=l.measure AND s.item1=l.item1 AND s.item2=l.item2').fetchall()
+
+        return {(measure, item1, item2):value for measure, item1, item2, value in rows}
+
+    def set(self, measure, item1, item2, value):
+        ''' Store the similarity of a pair of items '''
+        key = create_key(measure, item1, item2)
+        self.__memory.pop(key, None)
+        self.__memory[key] = value
+        self.__pending[key] = value
+        self.evict()
+
+        if len(self.__pending) >= self.__flush_size:
+            self.flush()
+
+    def set_many(self, measure, pairs, values):
+        ''' Store the similarities of a list of (item1, item2) pairs '''
+        for (item1, item2), value in zip(pairs, values):
+            self.set(measure, item1, item2, float(value))
+
+    def evict(self):
+        ''' Remove the least recently used similarities from memory '''
+        while len(self.__memory) > self.__max_size:
+            self.__memory.popitem(last=False)
+
+    def flush(self):
+        ''' Write the new similarities to disk '''
+        if self.__pending:
+            connection = self.get_connection()
+            with connection:
+                connection.executemany('INSERT OR REPLACE INTO similarities VALUES (?, ?, ?, ?)', [k + (v,) for k, v in self.__pending.items()])
+            self.__pending = {}
+
+    def close(self):
+        ''' Flush the new similarities and log the statistics of this process '''
+        self.flush()
+        logging.info('Similarity cache in process %d: %s' % (os.getpid(), self.statistics()))
+
+    def statistics(self):
+        ''' Get the hits (in memory and on disk) and misses of the cache '''
+        total = self.hits + self.disk_hits + self.misses
+
+        return {'hits':self.hits, 'disk_hits':self.disk_hits, 'misses':self.misses, 'size':len(self.__memory),
+                'hit_rate':(self.hits + self.disk_hits) / float(total) if total else 0.0}
+
+    def get_connection(self):
+        ''' Open a connection for the current process, since SQLite connections can not be shared after a fork '''
+        if self.__pid != os.getpid():
+            self.__pid = os.getpid()
+            self.hits = self.disk_hits = self.misses = 0
+            self.__connection = sqlite3.connect(self.__cache_path, timeout=60)
+            self.__connection.execute('PRAGMA journal_mode=WAL')
+            self.__connection.execute('CREATE TABLE IF NOT EXISTS similarities (measure TEXT, item1 TEXT, item2 TEXT, value REAL, PRIMARY KEY (measure, item1, item2))')
+            Finalize(self, self.close, exitpriority=10)
+
+        return self.__connection
+
+def create_key(measure, item1, item2):
+    ''' Create the key of a pair of items, which does not depend on their order '''
+    if item1 > item2:
+        item1, item2 = item2, item1
+
+    return (measure, item1, item2)
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*
+
+import os
+import logging
+import numpy as np
+from collections import deque
+from framestore import expand_ranges
+
+logging.basicConfig(level=logging.DEBUG, format='%(asctime)s %(levelname)s %(message)s')
+ARRAYS = ['is_verb', 'min_depth', 'max_depth', 'height', 'name_rank', 'ancestor_offsets', 'ancestor_ids', 'ancestor_distances']
+
+class WordNet_Hierarchy:
+    '''
+    Class that implements the hypernym hierarchy of WordNet 3.0 with integer synset ids, so that the Wu-Palmer
+    similarity of many pairs is computed with NumPy. For each synset it keeps all its ancestors (itself included)
+    with their shortest distance, as in NLTK.
+    '''
+
+    def __init__(self, offsets, arrays):
+        self.offsets = offsets # id -> WordNet 3.0 offset, e.g. '02084071-n'
+        self.index = {x:i for i, x in enumerate(offsets)}
+        for i, offset in enumerate(offsets):
+            if offset.endswith('-s'): # adjective satellites are '-a' in the WordNet mappings
+                self.index.setdefault(offset[:-1] + 'a', i)
+        for name in ARRAYS:
+            setattr(self, name, arrays[name])
+
+    def get_ids(self, offsets):
+        ''' Get the ids of a list of WordNet 3.0 offsets '''
+        return np.array([self.index[x] for x in offsets], dtype=np.int64)
+
+    def wup_similarity(self, ids1, ids2):
+        ''' Compute the Wu-Palmer similarity of each pair (ids1[i], ids2[i]), with the same results than
+        NLTK's wup_similarity (simulate_root=True, use_min_depth=True) and 0.0 when NLTK returns None '''
+        ids1 = np.asarray(ids1, dtype=np.int64)
+        ids2 = np.asarray(ids2, dtype=np.int64)
+        size = len(ids1)
+        num_synsets = len(self.min_depth)
+        similarities = np.zeros(size)
+        if size == 0:
+            return similarities
+
+        # common ancestors of each pair
+        pairs1, ancestors1, distances1 = self.expand_ancestors(ids1)
+        pairs2, ancestors2, distances2 = self.expand_ancestors(ids2)
+        common1, common2 = match_keys(pairs1 * num_synsets + ancestors1, pairs2 * num_synsets + ancestors2)
+        common_pairs = pairs1[common1]
+        common_ancestors = ancestors1[common1]
+
+        # lowest common hypernyms: those with the maximum min_depth, where verbs (first synset) also have a fake root of depth 0
+        need_root = self.is_verb[ids1]
+        best_depth = np.full(size, -1, dtype=np.int64)
+        np.maximum.at(best_depth, common_pairs, self.min_depth[common_ancestors])
+        best_depth[need_root] = np.maximum(best_depth[need_root], 0)
+        lowest = self.min_depth[common_ancestors] == best_depth[common_pairs]
+        lowest_pairs = common_pairs[lowest]
+        lowest_ancestors = common_ancestors[lowest]
+
+        # the subsumer is the first synset if it is a lowest common hypernym, then the fake root, then the first by name
+        rank = np.where(lowest_ancestors == ids1[lowest_pairs], -2, self.name_rank[lowest_ancestors])
+        order = np.lexsort((rank, lowest_pairs))
+        first = np.ones(len(order), dtype=bool) # pairs without common hypernyms have no rows
+        first[1:] = lowest_pairs[order][1:] != lowest_pairs[order][:-1]
+        first = order[first]
+        subsumers = np.full(size, -1, dtype=np.int64)
+        subsumer_rank = np.full(size, num_synsets, dtype=np.int64)
+        subsumers[lowest_pairs[first]] = lowest_ancestors[first]
+        subsumer_rank[lowest_pairs[first]] = rank[first]
+        fake_root = need_root & (best_depth == 0) & (subsumer_rank != -2)
+
+        # the fake root has depth 1 and is one step above the farthest ancestor of each synset
+        similarities[fake_root] = 2.0 / (self.height[ids1[fake_root]] + self.height[ids2[fake_root]] + 4.0)
+
+        real = np.flatnonzero((subsumers >= 0) & ~fake_root)
+        if len(real) > 0:
+            depth = self.max_depth[subsumers[real]] + 1.0
+            length1 = self.subsumer_distance(ids1[real], subsumers[real])
+            length2 = self.subsumer_distance(ids2[real], subsumers[real])
+            similarities[real] = 2.0 * depth / (length1 + length2 + 2.0 * depth)
+
+        return similarities
+
+    def subsumer_distance(self, ids, subsumers):
+        ''' Compute NLTK's shortest_path_distance between each synset and its subsumer, i.e. the shortest path
+        through an ancestor of the subsumer '''
+        num_synsets = len(self.min_depth)
+        pairs1, ancestors1, distances1 = self.expand_ancestors(ids)
+        pairs2, ancestors2, distances2 = self.expand_ancestors(subsumers)
+        common1, common2 = match_keys(pairs1 * num_synsets + ancestors1, pairs2 * num_synsets + ancestors2)
+        lengths = np.full(len(ids), np.iinfo(np.int64).max, dtype=np.int64)
+        np.minimum.at(lengths, pairs1[common1], distances1[common1] + distances2[common2])
+
+        return lengths
+
+    def expand_ancestors(self, ids):
+        ''' Get the (pair, ancestor, distance) rows of the ancestors of each synset '''
+        starts = self.ancestor_offsets[ids]
+        counts = self.ancestor_offsets[ids + 1] - starts
+        pairs = np.repeat(np.arange(len(ids)), counts)
+        positions = expand_ranges(starts, counts)
+
+        return pairs, self.ancestor_ids[positions].astype(np.int64), self.ancestor_distances[positions].astype(np.int64)
+
+    def save(self, hierarchy_path):
+        ''' Save the hierarchy in a NumPy .npz file '''
+        arrays = {x:getattr(self, x) for x in ARRAYS}
+        np.savez(hierarchy_path, offsets=np.array(self.offsets), **arrays)
+
+def load_hierarchy(hierarchy_path, offsets_path):
+    ''' Load the hierarchy, building it from NLTK if the file does not exist or is older than the offsets file '''
+    if os.path.exists(hierarchy_path) and os.path.getmtime(hierarchy_path) >= os.path.getmtime(offsets_path):
+        with np.load(hierarchy_path) as data:
+            return WordNet_Hierarchy(data['offsets'].tolist(), {x:data[x] for x in ARRAYS})
+
+    hierarchy = build_hierarchy(offsets_path)
+    hierarchy.save(hierarchy_path)
+
+    return hierarchy
+
+def build_hierarchy(offsets_path):
+    ''' Build the hierarchy of the synsets in the offsets file using NLTK '''
+    from nltk.corpus import wordnet # only needed to build the hierarchy, and slow to import
+    logging.info('building the WordNet 3.0 hierarchy')
+
+    offsets = []
+    synsets = []
+    with open(offsets_path) as fin:
+        for line in fin:
+            offset, name = line.rstrip().split('\t')
+            offsets.append(offset)
+            synsets.append(wordnet.synset(name))
+    index = {x.name():i for i, x in enumerate(synsets)}
+
+    ancestor_offsets = [0]
+    ancestor_ids = []
+    ancestor_distances = []
+    heights = []
+    for synset in synsets: # also visits the ancestors appended while iterating
+        distances = hypernym_distances(synset)
+        heights.append(max(distances.values()))
+        for ancestor, distance in distances.items():
+            if ancestor.name() not in index: # an ancestor missing in the offsets file
+                index[ancestor.name()] = len(synsets)
+                offsets.append('%08d-%s' % (ancestor.offset(), ancestor.pos()))
+                synsets.append(ancestor)
+            ancestor_ids.append(index[ancestor.name()])
+            ancestor_distances.append(distance)
+        ancestor_offsets.append(len(ancestor_ids))
+
+    names = [x.name() for x in synsets]
+    name_rank = np.empty(len(names), dtype=np.int64)
+    name_rank[np.argsort(names, kind='mergesort')] = np.arange(len(names))
+    arrays = {
+        'is_verb': np.array([x.pos() == 'v' for x in synsets], dtype=bool),
+        'min_depth': np.array([x.min_depth() for x in synsets], dtype=np.int64),
+        'max_depth': np.array([x.max_depth() for x in synsets], dtype=np.int64),
+        'height': np.array(heights, dtype=np.int64),
+        'name_rank': name_rank,
+        'ancestor_offsets': np.array(ancestor_offsets, dtype=np.int64),
+        'ancestor_ids': np.array(ancestor_ids, dtype=np.int32),
+        'ancestor_distances': np.array(ancestor_distances, dtype=np.int16)
+    }
+
+    return WordNet_Hierarchy(offsets, arrays)
+
+def hypernym_distances(synset):
+    ''' Get the shortest distance from a synset to each of its ancestors, itself included '''
+    distances = {}
+    queue = deque([(synset, 0)])
+
+    while queue:
+        current, distance = queue.popleft()
+        if current in distances:
+            continue
+        distances[current] = distance
+        queue.extend((x, distance + 1) for x in current.hypernyms() + current.instance_hypernyms())
+
+    return distances
+
+def match_keys(keys1, keys2):
+    ''' Get the positions (i, j) where keys1[i] == keys2[j], for arrays without repeated keys '''
+    order = np.argsort(keys2, kind='mergesort')
+    sorted_keys = keys2[order]
+    positions = np.searchsorted(sorted_keys, keys1)
+    positions[positions == len(sorted_keys)] = 0
+    found = np.flatnonzero(sorted_keys[positions] == keys1) if len(sorted_keys) > 0 else np.array([], dtype=np.int64)
+
+    return found, order[positions[found]]
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*
+
+import os
+import atexit
+import logging
+import multiprocessing
+
+logging.basicConfig(level=logging.DEBUG, format='%(asctime)s %(levelname)s %(message)s')
+settings = {'processes': 1, 'pool': None}
+shared = {} # read-only objects of the pipeline, e.g. the validator, that the workers get from the fork
+worker_setups = [] # functions run once in each worker when it starts, e.g. to load the similarity resources
+
+def set_processes(processes):
+    ''' Set the number of workers of the pool, closing the current pool if it has a different size '''
+    if processes != settings['processes']:
+        close_pool()
+        settings['processes'] = processes
+
+def share(**objects):
+    ''' Make some objects available to the workers, which get them when they are forked, so the pool is started
+    again the next time it is needed if it was already running '''
+    shared.update(objects)
+    close_pool()
+
+def add_worker_setup(function):
+    ''' Add a function to run once in each worker, e.g. to load resources. It also runs now in this process, so the
+    workers forked from now on inherit what it loads instead of loading it again '''
+    if function not in worker_setups:
+        function()
+        worker_setups.append(function)
+        close_pool()
+
+def get_pool():
+    ''' Get the worker pool of the pipeline, creating it the first time, or None if there is only one process or it
+    is called inside a worker. The pool is created lazily so that the workers inherit the stores of frame
+    instances loaded before, which the views of frame instances need to be unpickled '''
+    if settings['processes'] <= 1 or multiprocessing.current_process().daemon:
+        return None
+    if settings['pool'] is None:
+        logging.info('Starting a pool of %d workers' % settings['processes'])
+        settings['pool'] = multiprocessing.Pool(processes=settings['processes'], initializer=init_worker)
+
+    return settings['pool']
+
+def get_processes():
+    ''' Get the number of processes that work in parallel '''
+    return settings['processes'] if get_pool() is not None else 1
+
+def close_pool():
+    ''' Wait for the workers of the pool to finish and close it '''
+    pool = settings['pool']
+    settings['pool'] = None
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+def init_worker():
+    ''' Run the setup functions in a new worker, logging their errors instead of letting the pool start the
+    worker again and again '''
+    settings['pool'] = None # a worker started again by the pool inherits it
+    for function in worker_setups:
+        try:
+            function()
+        except Exception:
+            logging.exception('Error in the setup of worker %d' % os.getpid())
+
+atexit.register(close_pool)
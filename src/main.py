@@ -46,7 +46,10 @@ if __name__ == '__main__':
         vgen.download_images(visualgenome_parsed_path, downloaded_images_path)
     elif option == 'frames':
         validator = sys.argv[2] if len(sys.argv) > 2 else 'core'
-        frms.create_dataset(validator, frame_raw_path, frame_parsed_path)
+        numbers = [int(x) for x in sys.argv[3:] if x.isdigit()]
+        processes = numbers[0] if numbers else 4
+        streaming = 'streaming' in sys.argv[3:]
+        frms.create_dataset(validator, frame_raw_path, frame_parsed_path, processes, streaming)
         frms.select_relations(frame_parsed_path, house_objects_path)
         frms.download_images(frame_parsed_path, downloaded_images_path)
 
@@ -3,7 +3,9 @@ import os
 import re
 import json
 import codecs
-from os.path import dirname, join
+import cPickle
+import hashlib
+from os.path import dirname, join, exists, getmtime
 
 def save_json(data, json_path, sort_keys=True):
     ''' Save a dictionary into a JSON file '''
@@ -31,6 +33,45 @@ def load_file(file_path):
 
     return lines
 
+def load_compiled(compiled_path, source_paths, build_function):
+    ''' Load an object pickled from some source files, building and pickling it again if it does not exist or is older than them '''
+    if exists(compiled_path) and all(getmtime(compiled_path) >= getmtime(x) for x in source_paths):
+        with open(compiled_path, 'rb') as fin:
+            return cPickle.load(fin)
+
+    data = build_function()
+    with open(compiled_path + '.tmp', 'wb') as fout:
+        cPickle.dump(data, fout, cPickle.HIGHEST_PROTOCOL)
+    os.rename(compiled_path + '.tmp', compiled_path)
+
+    return data
+
+def load_compiled_folder(compiled_path, folder_path, build_function):
+    ''' Load an object pickled from the files of a folder, building and pickling it again if any file was added,
+    removed or modified since then '''
+    signature = get_folder_signature(folder_path)
+    if exists(compiled_path):
+        with open(compiled_path, 'rb') as fin:
+            compiled = cPickle.load(fin)
+        if compiled['signature'] == signature:
+            return compiled['data']
+
+    data = build_function()
+    with open(compiled_path + '.tmp', 'wb') as fout:
+        cPickle.dump({'signature':signature, 'data':data}, fout, cPickle.HIGHEST_PROTOCOL)
+    os.rename(compiled_path + '.tmp', compiled_path)
+
+    return data
+
+def get_folder_signature(folder_path):
+    ''' Get a signature of the names, sizes and modification times of the files in a folder '''
+    signature = hashlib.sha1()
+    for file_name in sorted(os.listdir(folder_path)):
+        stats = os.stat(join(folder_path, file_name))
+        signature.update('%s\t%d\t%r\n' % (file_name, stats.st_size, stats.st_mtime))
+
+    return signature.hexdigest()
+
 def map_wn31wn30():
     ''' Load mappings between WordNet 3.1 and WordNet 3.0 '''
     wn31wn30 = {}